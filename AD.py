@@ -6,8 +6,12 @@ import character_recognition
 import detect_voice_activity
 import divide_video
 import gen_AD_script
+import intervals
+import keyframe_sampling
 import merge_AD_script
 import SenseVoice
+import stage_cache
+import timeline
 
 
 def AD(certain_path,video_name_without_ext,video_path):
@@ -28,39 +32,142 @@ def AD(certain_path,video_name_without_ext,video_path):
     # certain_path=os.path.join(program_path, video_name_without_ext)
     # os.makedirs(certain_path, exist_ok=True)
     
+    # 各阶段的结果按输入内容和参数记录在 certain_path 下的清单中，重新运行时跳过未变化的阶段
+    cache=stage_cache.StageCache(certain_path)
+
     # 提取音频，压缩视频
     audio_path = os.path.join(certain_path, f"{video_name_without_ext}.wav")#视频的音频文件
+    audio_16k_path = os.path.join(certain_path, f"{video_name_without_ext}_16k.wav")#16kHz单声道音频，供VAD和SenseVoice使用
     compressed_video_path = os.path.join(certain_path, f"{video_name_without_ext}_compressed.mp4")#压缩后的视频
-    audio_extraction_video_compression.extract_audio_compress_video(video_path,audio_path,compressed_video_path)
+    cache.run_stage(
+        "extract",
+        lambda: audio_extraction_video_compression.extract_audio_compress_video(video_path,audio_path,compressed_video_path,audio_16k_path),
+        inputs=[video_path],
+        outputs=[audio_path,audio_16k_path,compressed_video_path],
+        params={
+            "audio_sample_rate": audio_extraction_video_compression.AUDIO_SAMPLE_RATE,
+            "audio_16k_sample_rate": audio_extraction_video_compression.AUDIO_16K_SAMPLE_RATE,
+            "video_height": audio_extraction_video_compression.VIDEO_HEIGHT,
+            "video_fps": audio_extraction_video_compression.VIDEO_FPS,
+            "video_crf": audio_extraction_video_compression.VIDEO_CRF,
+            "video_audio_bitrate": audio_extraction_video_compression.VIDEO_AUDIO_BITRATE,
+        },
+    )
 
     #人物角色识别
     identified_video_path=os.path.join(certain_path, f"{video_name_without_ext}_identified.mp4")#人物角色识别之后的视频
     CHARACTER_BANK_PATH=os.path.join(certain_path, 'photos')
-    character_recognition.character_recognition(compressed_video_path,audio_path,identified_video_path,CHARACTER_BANK_PATH)
-    
-    #语音活动检测
-    vad_file_path = os.path.join(certain_path, f"{video_name_without_ext}_vad.csv")#语音端点检测结果
-    gap_file_path= os.path.join(certain_path, f"{video_name_without_ext}_gap.csv")#对白间隙
-    detect_voice_activity.fsmn_vad(audio_path,vad_file_path,gap_file_path)
-    
+    cache.run_stage(
+        "character_recognition",
+        lambda: character_recognition.character_recognition(compressed_video_path,audio_path,identified_video_path,CHARACTER_BANK_PATH),
+        inputs=[compressed_video_path,audio_path,CHARACTER_BANK_PATH],
+        outputs=[identified_video_path],
+        params={
+            "similarity_threshold": character_recognition.SIMILARITY_THRESHOLD,
+            "detection_interval": character_recognition.DETECTION_INTERVAL,
+            "scene_cut_threshold": character_recognition.SCENE_CUT_THRESHOLD,
+            "keyframe_interval": character_recognition.KEYFRAME_INTERVAL,
+        },
+    )
+
+    #语音活动检测（各阶段之间直接传递 timeline.Timeline，检查点保存为 .npz）
+    vad_checkpoint_path = os.path.join(certain_path, f"{video_name_without_ext}_vad.npz")#语音端点检测结果
+    speech=cache.run_checkpoint_stage(
+        "vad",
+        lambda: detect_voice_activity.fsmn_vad(audio_16k_path)[0],
+        inputs=[audio_16k_path],
+        checkpoint_path=vad_checkpoint_path,
+        load=timeline.Timeline.load,
+        params={
+            "model": detect_voice_activity.VAD_MODEL,
+            "chunk_ms": detect_voice_activity.VAD_CHUNK_MS,
+            "min_gap": detect_voice_activity.MIN_GAP,
+            "gap_pad": detect_voice_activity.GAP_PAD,
+            "gap_lookahead": detect_voice_activity.GAP_LOOKAHEAD,
+            "speech_join": detect_voice_activity.SPEECH_JOIN,
+        },
+    )
+    if speech is None:
+        print("未检测到语音，无法生成AD脚本。")
+        return
+    gaps=detect_voice_activity.speech_gaps(speech)#对白间隙，由语音段直接计算
+
     #结合语音活动检测结果给视频分段，也给对白间隙进行分段
     video_seg_dir=os.path.join(certain_path, 'video_seg')#分段视频存放文件夹
     os.makedirs(video_seg_dir, exist_ok=True)
-    valid_timestamps=divide_video.split_video_by_thresholds(vad_file_path,identified_video_path,video_seg_dir,600)#600s一段
-    if valid_timestamps:divide_video.split_gap_csv(valid_timestamps,gap_file_path,video_seg_dir)
-    
-    # 生成AD脚本
-    for video_file in os.listdir(video_seg_dir):
-        if video_file.endswith('.mp4'):
-            video_file_path = os.path.join(video_seg_dir, video_file)
-            base_path, _ = os.path.splitext(video_file_path)# 分离路径的主干部分和扩展名
-            gap_path = base_path + ".csv"# 拼接主干部分和新的 .csv  扩展名
-            AD_script_path=base_path+"_AD_script.csv"
-            with open(AD_script_path, 'w') as file:# 在 'w' 模式下打开文件时，如果文件是新的或者被清空了，它就是空的。
-                pass # 'pass' 语句表示这里什么也不做
-            gen_AD_script.gen_AD_script(video_file_path,gap_path,AD_script_path)
-    #将AD脚本片段合成为一整个AD脚本
-    merge_AD_script.merge_AD_script(video_seg_dir)
+    def split_stage():
+        # 清除上一次运行留下的片段视频和间隙文件，避免分段数变化后残留旧片段。
+        # 各片段的 AD 脚本检查点（segment_N_AD_script.npz）保留：其缓存键包含片段内容和间隙，
+        # 重新切出的片段内容不变时直接复用，变化时自动重新生成
+        for old_file in os.listdir(video_seg_dir):
+            if (old_file.startswith('segment_') and old_file.endswith(('.mp4', '.csv'))) or old_file == 'divide_timastamps.txt':
+                os.remove(os.path.join(video_seg_dir, old_file))
+        timestamps=divide_video.split_video_by_thresholds(speech,identified_video_path,video_seg_dir,600,stream_copy=True)#600s一段；_identified.mp4 已是 360p/1fps 的 H.264，直接流复制
+        if not timestamps:
+            return False
+        return timestamps
+    timestamps_path=os.path.join(video_seg_dir, "divide_timastamps.txt")
+    valid_timestamps=cache.run_stage(
+        "split",
+        split_stage,
+        inputs=[vad_checkpoint_path,identified_video_path],
+        outputs=[timestamps_path],
+        params={"threshold_step": 600, "stream_copy": True, "search_ratio": divide_video.BOUNDARY_SEARCH_RATIO},
+    )
+    if not valid_timestamps:
+        print("视频分段失败，无法生成AD脚本。")
+        return
+    segment_timeline=intervals.SegmentTimeline(valid_timestamps)
+    segment_gaps=divide_video.split_gaps(valid_timestamps,gaps,detect_voice_activity.MIN_GAP)#跨越分割点的间隙裁剪到片段边界内
+
+    # 生成AD脚本（多个片段并发处理，已生成且输入未变的片段直接跳过）
+    gemini_params={
+        "model": gen_AD_script.MODEL_NAME,
+        "prompt": gen_AD_script.PROMPT_TEMPLATE,
+        "use_keyframes": gen_AD_script.USE_KEYFRAMES,
+        "keyframe_gaps": [keyframe_sampling.MIN_KEYFRAME_GAP, keyframe_sampling.MAX_KEYFRAME_GAP],
+        "keyframe_thresholds": [keyframe_sampling.SCENE_CUT_THRESHOLD, keyframe_sampling.CONTENT_CHANGE_THRESHOLD],
+    }
+    def gemini_stage(video_file_path,gaps_in_segment,AD_script_path):
+        return cache.run_checkpoint_stage(
+            f"gemini:{os.path.basename(video_file_path)}",
+            lambda: gen_AD_script.describe_segment(video_file_path,gaps_in_segment),
+            inputs=[video_file_path],
+            checkpoint_path=AD_script_path,
+            load=timeline.Timeline.load,
+            params=dict(gemini_params, gaps=gaps_in_segment.fingerprint()),
+        )
+    jobs=[]
+    segment_numbers=[]
+    for segment_number in range(1, len(segment_timeline)+1):
+        video_file_path = os.path.join(video_seg_dir, f"segment_{segment_number}.mp4")
+        if not os.path.exists(video_file_path):
+            continue
+        AD_script_path=os.path.join(video_seg_dir, f"segment_{segment_number}_AD_script.npz")
+        jobs.append((video_file_path,segment_gaps[segment_number-1],AD_script_path))
+        segment_numbers.append(segment_number)
+    segment_scripts=[None]*len(segment_timeline)
+    for segment_number, script in zip(segment_numbers, gen_AD_script.gen_AD_scripts(jobs, runner=gemini_stage)):
+        segment_scripts[segment_number-1]=script
+
+    #将AD脚本片段合成为一整个AD脚本，再识别每条AD处的情感
+    merged=merge_AD_script.merge_AD_scripts(segment_scripts, segment_timeline)
+    merged_checkpoint_path=os.path.join(video_seg_dir, 'merged_AD_scripts.npz')
+    merged_csv_path=os.path.join(video_seg_dir, 'merged_AD_scripts.csv')
+    sense_params={"script": merged.fingerprint()}
+    sense_fresh=cache.is_fresh("sensevoice", [audio_16k_path], [merged_checkpoint_path], sense_params)
+    script=cache.run_checkpoint_stage(
+        "sensevoice",
+        lambda: SenseVoice.Sense_timeline(merged,audio_16k_path),
+        inputs=[audio_16k_path],
+        checkpoint_path=merged_checkpoint_path,
+        load=timeline.Timeline.load,
+        params=sense_params,
+    )
+    if script is None:
+        print("情感识别失败，未生成合并后的AD脚本。")
+        return
 
-    SenseVoice.Sense_add(f'{video_seg_dir}/merged_AD_scripts.csv',audio_path,certain_path)
-    
\ No newline at end of file
+    # merged_AD_scripts.csv 供界面查看和编辑；脚本未变化时不覆盖用户的修改
+    if not sense_fresh or not os.path.exists(merged_csv_path):
+        script.to_csv(merged_csv_path)
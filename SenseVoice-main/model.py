@@ -637,6 +637,14 @@ class SenseVoiceSmall(nn.Module):
         self.textnorm_int_dict = {25016: 14, 25017: 15}
         self.embed = torch.nn.Embedding(7 + len(self.lid_dict) + len(self.textnorm_dict), input_size)
         self.emo_dict = {"unk": 25009, "happy": 25001, "sad": 25002, "angry": 25003, "neutral": 25004}
+        # output positions of the rich tokens: <|language|><|emotion|><|event|><|textnorm|>
+        self.rich_positions = {"language": 0, "emotion": 1, "event": 2}
+        self.rich_labels = {
+            "language": ["zh", "en", "yue", "ja", "ko", "nospeech"],
+            "emotion": ["HAPPY", "SAD", "ANGRY", "NEUTRAL", "FEARFUL", "DISGUSTED", "SURPRISED", "EMO_UNKNOWN"],
+            "event": ["Speech", "BGM", "Applause", "Laughter", "Cry", "Sneeze", "Breath", "Cough"],
+        }
+        self._rich_token_ids = None
         
         self.criterion_att = LabelSmoothingLoss(
             size=self.vocab_size,
@@ -778,17 +786,17 @@ class SenseVoiceSmall(nn.Module):
         return loss_rich, acc_rich
 
 
-    def inference(
+    def encode_with_queries(
         self,
         data_in,
         data_lengths=None,
-        key: list = ["wav_file_tmp_name"],
         tokenizer=None,
         frontend=None,
         **kwargs,
     ):
-
-
+        """Frontend + query embeddings + Encoder, shared by inference and inference_rich.
+        The first 4 output frames correspond to the language, emotion, event and textnorm queries.
+        """
         meta_data = {}
         if (
             isinstance(data_in, torch.Tensor) and kwargs.get("data_type", "sound") == "fbank"
@@ -851,6 +859,99 @@ class SenseVoiceSmall(nn.Module):
         if isinstance(encoder_out, tuple):
             encoder_out = encoder_out[0]
 
+        return encoder_out, encoder_out_lens, meta_data
+
+    @staticmethod
+    def _special_token_id(tokenizer, piece):
+        encoded = tokenizer.encode(piece)  # also builds the sentencepiece processor lazily
+        sp = getattr(tokenizer, "sp", None)
+        if sp is not None:
+            token_id = sp.piece_to_id(piece)
+            return None if token_id == sp.unk_id() else token_id
+        # drop the word-boundary piece some tokenizers prepend
+        encoded = [token_id for token_id in encoded if tokenizer.decode([token_id]).strip()]
+        return encoded[0] if len(encoded) == 1 else None
+
+    def rich_token_ids(self, tokenizer, ban_emo_unk=False):
+        """Token ids of the candidate labels at each rich position, resolved once through the tokenizer."""
+        if getattr(self, "_rich_token_ids", None) is None:
+            token_ids = {}
+            for field, labels in self.rich_labels.items():
+                names, ids = [], []
+                for label in labels:
+                    token_id = self._special_token_id(tokenizer, f"<|{label}|>")
+                    if token_id is not None:
+                        names.append(label)
+                        ids.append(token_id)
+                token_ids[field] = (names, ids)
+            self._rich_token_ids = token_ids
+        if not ban_emo_unk:
+            return self._rich_token_ids
+        names, ids = self._rich_token_ids["emotion"]
+        keep = [i for i, token_id in enumerate(ids) if token_id != self.emo_dict["unk"]]
+        banned = dict(self._rich_token_ids)
+        banned["emotion"] = ([names[i] for i in keep], [ids[i] for i in keep])
+        return banned
+
+    def inference_rich(
+        self,
+        data_in,
+        data_lengths=None,
+        key: list = ["wav_file_tmp_name"],
+        tokenizer=None,
+        frontend=None,
+        **kwargs,
+    ):
+        """Emotion-only fast path: language, emotion and event posteriors from the first encoder frames.
+
+        Only the rich positions are projected through the CTC output layer, so the full-sequence
+        log-softmax, CTC argmax and text decoding are skipped. Probabilities are normalised over
+        the candidate labels of each position.
+        """
+        encoder_out, encoder_out_lens, meta_data = self.encode_with_queries(
+            data_in, data_lengths, tokenizer=tokenizer, frontend=frontend, **kwargs
+        )
+        rich_logits = self.ctc.ctc_lo(encoder_out[:, : max(self.rich_positions.values()) + 1, :])
+        token_ids = self.rich_token_ids(tokenizer, kwargs.get("ban_emo_unk", False))
+
+        b = encoder_out.size(0)
+        if isinstance(key[0], (list, tuple)):
+            key = key[0]
+        if len(key) < b:
+            key = key * b
+        results = [{"key": key[i]} for i in range(b)]
+        for field, position in self.rich_positions.items():
+            names, ids = token_ids[field]
+            if not ids:
+                continue
+            probs = torch.softmax(
+                rich_logits[:, position, torch.LongTensor(ids).to(rich_logits.device)].float(), dim=-1
+            ).cpu()
+            best_prob, best = probs.max(dim=-1)
+            for i in range(b):
+                results[i][field] = names[best[i].item()]
+                results[i][f"{field}_prob"] = best_prob[i].item()
+                results[i][f"{field}_probs"] = dict(zip(names, probs[i].tolist()))
+        return results, meta_data
+
+    def inference(
+        self,
+        data_in,
+        data_lengths=None,
+        key: list = ["wav_file_tmp_name"],
+        tokenizer=None,
+        frontend=None,
+        **kwargs,
+    ):
+        if kwargs.get("rich_only", False):
+            return self.inference_rich(
+                data_in, data_lengths, key=key, tokenizer=tokenizer, frontend=frontend, **kwargs
+            )
+
+        encoder_out, encoder_out_lens, meta_data = self.encode_with_queries(
+            data_in, data_lengths, tokenizer=tokenizer, frontend=frontend, **kwargs
+        )
+
         # c. Passed the encoder result and the beam search
         ctc_logits = self.ctc.log_softmax(encoder_out)
         if kwargs.get("ban_emo_unk", False):
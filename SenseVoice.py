@@ -1,53 +1,29 @@
-import csv
-import json
 import os
-import re
-import subprocess
-
-import pandas as pd
-
-
-def get_video_duration(video_path):
-    """Get video duration in seconds using ffprobe."""
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'json',
-        video_path
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-    metadata = json.loads(result.stdout)
-    return float(metadata['format']['duration'])
-            
+import threading
+import wave
+
+import numpy as np
+
+import intervals
+import timeline
+
+SENSEVOICE_MODEL = "iic/SenseVoiceSmall"
+SENSEVOICE_REMOTE_CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SenseVoice-main", "model.py")
+SENSEVOICE_BATCH_SIZE = 64 # 每批最多的片段数
+SENSEVOICE_BATCH_SECONDS = 300 # 每批按最长片段补齐后的总音频时长上限（秒），与 webui 的 batch_size_s 含义相同
+MIN_SNIPPET_SECONDS = 0.5 # 片段被音频末尾截得过短时，向前补足到该长度
+
+
+def emotion_windows(script,video_end):
+    """每条 AD 取开头前后 [start-10, start+1] 和结尾前后 [end-1, end+10] 两个窗口。"""
+    gaps = intervals.edge_windows(script.start, script.duration, before=10, after=1, shrink=1, end_time=video_end)
+    return gaps.tolist()
 
 def read_gap_file(filepath,video_end):
     """读取并解析对白间隙信息文件。"""
 
-    # video_end=get_video_duration(filepath)
-    gaps = []
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for i, row in enumerate(reader):
-                # 跳过空行或格式不正确的行
-                if i == 0 :
-                    continue
-                start_time=float(row[0].strip())
-                end_time=start_time+float(row[1].strip())-1
-                gaps.append([round(max(0,start_time-10),1),round(start_time+1,1)])
-                gaps.append([round(end_time,1),round(min(video_end,end_time+11),1)])
-                # print("111:")
-                # print(max(0,start_time-10))
-                # print(start_time+1)
-                # print({max(0,start_time-10),start_time+1})
-                # print("222:")
-                # print({end_time,min(video_end,end_time+11)})
-                # print(round(max(0,start_time-10),1))
-                # print(round(start_time+1,1))
-                # print([round(max(0,start_time-10),1),round(start_time+1,1)])
-
-        return gaps
+        return emotion_windows(timeline.Timeline.from_csv(filepath),video_end)
     except FileNotFoundError:
         print(f"错误: 找不到间隙文件 {filepath}")
         return None
@@ -55,130 +31,187 @@ def read_gap_file(filepath,video_end):
         print(f"读取间隙文件时发生错误 {filepath}: {e}")
         return None
 
-def auto_cutting(wav_file,timestamps,folder_path):    
-    input_file = wav_file
-    try:
-        os.mkdir(folder_path)
-        print(f"文件夹 '{folder_path}' 新建成功")
-    except FileExistsError:
-        print(f"文件夹 '{folder_path}' 已经存在")
-    except Exception as e:
-        print(f"新建文件夹时出错: {e}")
-    
-    out_file_list=[]
-    new_tamps=[]
-    for idx, (start_ms, end_ms) in enumerate(timestamps, start=0):
-        # 转换毫秒为秒（保留两位小数）
-        start_sec = start_ms
-        end_sec = end_ms
-        # 生成输出文件名并存入列表
-        output_file0 = f"segment_{idx:04d}"
-        output_file = f"{folder_path}\{output_file0}.wav"
-        out_file_list.append(f"{output_file0}\t{output_file}")
-        new_tamps.append([start_sec,end_sec]) 
-
-        #print(new_tamps)  
-        # 构建FFmpeg命令
-        command = [
-            "ffmpeg",
-            "-ss", str(start_sec),
-            "-to", str(end_sec),
-            "-i", input_file,
-            "-c", "copy",
-            "-y",
-            output_file
+def load_waveform(audio_path):
+    """
+    把 16 位 PCM WAV 整体解码到内存。
+
+    Returns:
+        tuple: (float32 单声道波形, 采样率)。
+    """
+    with wave.open(audio_path, 'rb') as wav:
+        sample_rate = wav.getframerate()
+        channels = wav.getnchannels()
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{audio_path} 不是 16 位 PCM WAV")
+        data = wav.readframes(wav.getnframes())
+    waveform = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+    if channels > 1:
+        waveform = waveform.reshape(-1, channels).mean(axis=1)
+    return waveform, sample_rate
+
+def slice_windows(waveform,sample_rate,windows):
+    """按 [起始秒, 结束秒] 从波形中切出片段，返回的都是 waveform 的视图，不复制数据。"""
+    bounds = np.clip(np.round(np.asarray(windows, dtype=np.float64).reshape(-1, 2) * sample_rate), 0, len(waveform)).astype(np.int64)
+    min_samples = int(MIN_SNIPPET_SECONDS * sample_rate)
+    snippets = []
+    for begin, end in bounds.tolist():
+        if end - begin < min_samples:
+            begin = max(0, end - min_samples)
+        snippets.append(waveform[begin:end])
+    return snippets
+
+def plan_batches(lengths, max_batch_samples, max_batch_size=SENSEVOICE_BATCH_SIZE):
+    """
+    按长度排序后分批：每批补齐到批内最长片段后的总样本数不超过 max_batch_samples，
+    片段数不超过 max_batch_size。长度相近的片段落在同一批，补齐浪费小。
+
+    Returns:
+        tuple: (批次列表，每批为原始下标的列表, 补齐样本占比)。
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    current = []
+    for index in order.tolist():
+        # 升序排列，新加入的片段就是批内最长的
+        if current and (len(current) >= max_batch_size or (len(current) + 1) * lengths[index] > max_batch_samples):
+            batches.append(current)
+            current = []
+        current.append(index)
+    if current:
+        batches.append(current)
+    return batches, padding_ratio(lengths, batches)
+
+def padding_ratio(lengths, batches):
+    """分批后补齐的样本占全部送入模型的样本的比例。"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    padded = sum(int(lengths[batch].max()) * len(batch) for batch in batches if batch)
+    return 1.0 - lengths.sum() / padded if padded else 0.0
+
+
+class SenseVoiceService:
+    """
+    SenseVoiceSmall 服务。模型在第一次使用时加载一次，之后在同一进程处理的所有影片之间复用；
+    有 CUDA 时使用 GPU，否则使用 CPU。
+    """
+
+    def __init__(self, model_name=SENSEVOICE_MODEL, device=None, batch_size=SENSEVOICE_BATCH_SIZE, batch_seconds=SENSEVOICE_BATCH_SECONDS):
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.model = None
+        self.lock = threading.Lock()
+
+    def get_model(self):
+        with self.lock:
+            if self.model is None:
+                import torch
+                from funasr import AutoModel
+
+                if self.device is None:
+                    self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+                print(f"Initializing SenseVoiceSmall on {self.device}...")
+                self.model = AutoModel(
+                    model=self.model_name,
+                    trust_remote_code=True,
+                    remote_code=SENSEVOICE_REMOTE_CODE,
+                    device=self.device,
+                    ban_emo_unk=True,
+                    disable_update=True,
+                    disable_pbar=True,
+                )
+        return self.model
+
+    def recognize(self, spans, sample_rate=16000, rich_only=True):
+        """
+        对内存中的音频片段按长度分批（plan_batches）调用 SenseVoiceSmall.inference，
+        按原始顺序返回每个片段的结果。rich_only 为 True 时只取编码器前几帧的语种、情感和事件后验，不做文本解码。
+        """
+        import torch
+
+        model = self.get_model()
+        options = dict(model.kwargs)
+        options.update(language="auto", use_itn=True, ban_emo_unk=True, fs=sample_rate, rich_only=rich_only)
+
+        lengths = [len(x) for x in spans]
+        batches, waste = plan_batches(lengths, self.batch_seconds * sample_rate, self.batch_size)
+        fixed = [list(range(begin, min(begin + self.batch_size, len(spans)))) for begin in range(0, len(spans), self.batch_size)]
+        print(f"SenseVoice 分批: {len(spans)} 个片段 -> {len(batches)} 批，补齐占比 {waste:.1%}（按原顺序固定分批为 {padding_ratio(lengths, fixed):.1%}）")
+
+        res = [None] * len(spans)
+        with torch.no_grad():
+            for batch in batches:
+                keys = [f"snippet_{i:04d}" for i in batch]
+                data_in = [torch.from_numpy(np.ascontiguousarray(spans[i], dtype=np.float32)) for i in batch]
+                batch_res, _ = model.model.inference(data_in=data_in, key=keys, **options)
+                for i, item in zip(batch, batch_res):
+                    res[i] = item
+        return res
+
+    def classify_emotions(self, spans, sample_rate=16000):
+        """
+        识别每个音频片段的情感、声学事件和语种。
+
+        Args:
+            spans (list): 一维 float32 波形数组（如 slice_windows 返回的视图）。
+            sample_rate (int): 波形的采样率。
+
+        Returns:
+            list: 与 spans 顺序一致的字典，例如
+                  {'emotion': 'HAPPY', 'event': 'Speech', 'language': 'zh',
+                   'emotion_prob': 0.91, 'event_prob': 0.97, 'language_prob': 0.99}。
+        """
+        fields = ('emotion', 'event', 'language')
+        return [
+            {key: item.get(key, '' if key in fields else 0.0) for key in fields + tuple(f"{field}_prob" for field in fields)}
+            for item in self.recognize(spans, sample_rate)
         ]
-        # 执行命令
-        if idx > 0:
-            command += ["-loglevel", "error"]
-        subprocess.run(command)
 
-    with open("wav.scp", "w") as f:
-        f.write("\n".join(out_file_list))
 
-    return new_tamps
+sensevoice_service = None
+def get_global_sensevoice_service():
+    global sensevoice_service
+    if sensevoice_service is None:
+        sensevoice_service = SenseVoiceService()
+    return sensevoice_service
+
+def classify_emotions(spans, sample_rate=16000):
+    """用进程内共享的 SenseVoiceSmall 识别每个音频片段的情感、事件和语种。"""
+    return get_global_sensevoice_service().classify_emotions(spans, sample_rate)
+
+def SenseVoice(snippets,sample_rate):
+    """每两个片段（一条 AD 的开头和结尾）得到一个情感，两者不一致时记为中性。"""
+    res = classify_emotions(snippets, sample_rate)
+    print(f"SenseVoice 识别了 {len(res)} 个片段")
 
-def SenseVoice(wav_files,output_files):
-    from funasr import AutoModel
-    from funasr.utils.postprocess_utils import rich_transcription_postprocess
-    
-    try:
-        os.mkdir(output_files)
-        print(f"文件夹 '{output_files}' 新建成功")
-    except FileExistsError:
-        print(f"文件夹 '{output_files}' 已经存在")
-    except Exception as e:
-        print(f"新建文件夹时出错: {e}")
-    
-    
-    model_dir = "iic/SenseVoiceSmall"
-    model = AutoModel(
-        model=model_dir, 
-        trust_remote_code=True,
-        remote_code="./SenseVoice-main/model.py",
-        device="cuda:0",
-        ban_emo_unk=True,
-    )
-    # en
-    res = model.generate(
-        input=wav_files,
-        cache={},
-        language="auto", # "zh", "en", "yue", "ja", "ko", "nospeech","auto"
-        use_itn=True,
-        batch_size=64, 
-        output_dir = output_files
-    )
-    print(res)
-    print(res[0])
-    print(res[0]["text"])
-    print(len(res))
-    
     i=0
     result=[]
     while i<len(res)-1:
-        temp_result0 = [item for item in re.findall(r'<\|(.*?)\|>', res[i]["text"]) if item]
-        temp_result1 = [item for item in re.findall(r'<\|(.*?)\|>', res[i+1]["text"]) if item]
-        if(temp_result0[1]==temp_result1[1]):
-            result.append(temp_result0[1])
+        if res[i]['emotion']==res[i+1]['emotion']:
+            result.append(res[i]['emotion'])
         else:
             result.append('nEUTRAL')
         i+=2
     print(result)
     return result
 
-    # model = AutoModel(model=model_dir, trust_remote_code=True, device="cuda:0")
-
-    # res = model.generate(
-    #     input=wav_files,
-    #     cache={},
-    #     language="auto", # "zh", "en", "yue", "ja", "ko", "nospeech"
-    #     use_itn=True,
-    #     batch_size=64, 
-    #     output_dir = output_files,
-    # )
-
-def Sense_add(filepath,videopath,certain_path):
-    video_end=get_video_duration(videopath)
-    split=read_gap_file(filepath,video_end)
-    print(split)
-    auto_cutting(videopath,split,f'{certain_path}/temp_sense_cut1')
-    sense_res=SenseVoice("wav.scp",f'{certain_path}/temp_sense_cut2')
-    df = pd.read_csv(filepath)
-    df['Sense'] = sense_res
-    df.to_csv(filepath, index=False)
-    try:
-        # shutil.rmtree("./test")
-        # shutil.rmtree("./test1")
-        # os.remove("./test1/*")
-        os.remove("./wav.scp")
-        print("文件wav.scp已删除")
-    except Exception as e:
-        print(f"文件wav.scp删除失败: {e}")
+def Sense_timeline(script,audio_path):
+    """为 AD 脚本（timeline.Timeline）的每一条识别情感，返回填好 emotion 列的新时间轴。"""
+    waveform, sample_rate = load_waveform(audio_path)
+    video_end = len(waveform) / sample_rate
+    split=emotion_windows(script,video_end)
+    sense_res=SenseVoice(slice_windows(waveform,sample_rate,split),sample_rate)
+    result=script.take(slice(None))
+    result.emotion[:]=sense_res
+    return result
+
+def Sense_add(filepath,audio_path):
+    script=timeline.Timeline.from_csv(filepath)
+    Sense_timeline(script,audio_path).to_csv(filepath)
 
 
 if __name__ == '__main__':
     filepath=r"C:\Users\19059\AppData\Local\AD\BloodyBattleInTaierzhuang_5min\video_seg\merged_AD_scripts.csv"
-    videopath=r"C:\Users\19059\AppData\Local\AD\BloodyBattleInTaierzhuang_5min\BloodyBattleInTaierzhuang_5min.wav"
-    #Sense_add(filepath,videopath,certain_path)
-
-    
+    audio_path=r"C:\Users\19059\AppData\Local\AD\BloodyBattleInTaierzhuang_5min\BloodyBattleInTaierzhuang_5min_16k.wav"
+    #Sense_add(filepath,audio_path)
@@ -1,37 +1,67 @@
 import subprocess
 
+# 派生文件的编码参数（AD.py 把它们计入 "extract" 阶段的缓存键）
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_16K_SAMPLE_RATE = 16000
+VIDEO_HEIGHT = 360
+VIDEO_FPS = 1
+VIDEO_CRF = 28
+VIDEO_AUDIO_BITRATE = '1k'
 
-def extract_audio_compress_video(video_path,audio_path,compressed_video_path):
+def extract_audio_compress_video(video_path,audio_path,compressed_video_path,audio_16k_path=None):
+    """
+    只解码一次源视频，在同一个 ffmpeg 进程中输出流水线需要的全部派生文件：
+    44.1kHz 音频、16kHz 单声道音频（供 FSMN VAD 和 SenseVoice 使用）以及 360p/1fps 的压缩视频。
+
+    Args:
+        video_path (str): 源视频路径。
+        audio_path (str): 44.1kHz 音频输出路径。
+        compressed_video_path (str): 压缩视频输出路径。
+        audio_16k_path (str): 16kHz 单声道音频输出路径，为 None 时不输出。
+    """
     try:
-        # Extract audio from video with ffmpeg
         command = [
-            'ffmpeg',
+            'ffmpeg', '-y',
             '-i', video_path,
+            # 44.1kHz 音频
+            '-map', '0:a:0',
             '-vn',  # Disable video recording
             '-acodec', 'pcm_s16le',
-            '-ar', '44100',
-            audio_path
+            '-ar', str(AUDIO_SAMPLE_RATE),
+            audio_path,
         ]
-        subprocess.run(command, check=True, text=True)
-        print(f"Audio successfully extracted to: {audio_path}")
-
-        # Compress video with ffmpeg
-        video_command = [
-            'ffmpeg',
-            '-i', video_path,
-            '-vf', 'scale=-2:360',
-            '-r', '1',
+        if audio_16k_path:
+            # 16kHz 单声道音频，VAD 和 SenseVoice 无需再重采样
+            command += [
+                '-map', '0:a:0',
+                '-vn',
+                '-acodec', 'pcm_s16le',
+                '-ac', '1',
+                '-ar', str(AUDIO_16K_SAMPLE_RATE),
+                audio_16k_path,
+            ]
+        # 压缩视频
+        command += [
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+            '-vf', f'scale=-2:{VIDEO_HEIGHT}',
+            '-r', str(VIDEO_FPS),
             '-c:v', 'libx264',
-            '-crf','28',
+            '-crf', str(VIDEO_CRF),
             '-c:a', 'libopus',
             '-ac','1',
-            '-b:a', '1k',
+            '-b:a', VIDEO_AUDIO_BITRATE,
             compressed_video_path
         ]
-        subprocess.run(video_command, check=True, text=True)
+        subprocess.run(command, check=True, text=True)
+        print(f"Audio successfully extracted to: {audio_path}")
+        if audio_16k_path:
+            print(f"16kHz audio successfully extracted to: {audio_16k_path}")
         print(f"Video successfully compressed to: {compressed_video_path}")
 
     except subprocess.CalledProcessError as e:
         print(f"Error processing video: {e.stderr}")
+        return False # 输出可能不完整，不能被阶段缓存记录
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
\ No newline at end of file
+        print(f"An unexpected error occurred: {e}")
+        return False
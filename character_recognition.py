@@ -1,13 +1,19 @@
+import hashlib
+import json
 import os
 import subprocess
+import tempfile
 import time
 
 import cv2
 import insightface
 import numpy as np
 from insightface.app import FaceAnalysis
+from insightface.utils import face_align
 from PIL import Image, ImageDraw, ImageFont
 
+from keyframe_sampling import SCENE_CUT_THRESHOLD, frame_histogram, histogram_similarity
+
 # --- Global Setup (Model Initialization) ---
 # Initialize these once if the script runs continuously or calls the function multiple times.
 # If the script only calls the function once and exits, you could move this inside too.
@@ -20,7 +26,7 @@ def get_global_app():
         print("Initializing Face Analysis model...")
         try:
             # Prioritize GPU
-            app = FaceAnalysis(providers=['CUDAExecutionProvider'])
+            app = FaceAnalysis(allowed_modules=['detection', 'recognition'], providers=['CUDAExecutionProvider'])
             app.prepare(ctx_id=0, det_size=(480, 480))
             print("Model initialized successfully using CUDA.")
         except Exception as e:
@@ -28,7 +34,7 @@ def get_global_app():
             print("Attempting CPU only initialization...")
             try:
                 # Fallback to CPU
-                app = FaceAnalysis(providers=['CPUExecutionProvider'])
+                app = FaceAnalysis(allowed_modules=['detection', 'recognition'], providers=['CPUExecutionProvider'])
                 app.prepare(ctx_id=-1, det_size=(480, 480)) # Use -1 for CPU context
                 print("Model initialized successfully using CPU.")
             except Exception as cpu_e:
@@ -42,6 +48,12 @@ def get_global_app():
 # --- Configuration (Can be changed) ---
 
 SIMILARITY_THRESHOLD = 0.45 # Adjust this threshold as needed
+RECOGNITION_BATCH_SIZE = 16 # 每批读取的帧数，批内所有人脸一次性送入识别模型
+KEYFRAME_INTERVAL = 10 # 输出视频的关键帧间隔（秒）；流复制分段时只在含关键帧的静音处切割，间隔越小可选的静音越多
+DETECTION_INTERVAL = 3 # 两次检测之间最多间隔的帧数，中间的帧由 FaceTracker 推算人脸位置
+TRACK_IOU_THRESHOLD = 0.3 # 检测结果与已有轨迹关联所需的最小 IoU
+# 角色特征索引目录；为 None 时使用角色库旁的 "<角色库>_index" 目录。设为共享目录可在多部影片间复用特征
+FACE_INDEX_DIR = None
 
 
 # --- Font Configuration ---
@@ -56,9 +68,54 @@ BOX_COLOR = (0, 255, 0) # green
 #     print(f"Error loading font: {e}")
 #     exit()
 
+class LabelRenderer:
+    """
+    角色名标注渲染器。字体只加载一次，每个角色名第一次出现时用 Pillow 渲染成
+    alpha 位图并缓存，之后直接在 numpy 帧的对应区域做 alpha 混合。
+    """
+
+    def __init__(self, font_path=FONT_PATH, font_size=FONT_SIZE, color=TEXT_COLOR):
+        try:
+            self.font = ImageFont.truetype(font_path, font_size)
+        except IOError:
+            print(f"Error: Could not load font at {font_path}. Using default font.")
+            self.font = ImageFont.load_default()
+        self.color_bgr = np.array(color[::-1], dtype=np.float32) # TEXT_COLOR 为 RGB，帧为 BGR
+        self.glyphs = {}
+
+    def _glyph(self, label):
+        """返回 (alpha 位图 (h, w, 1), 相对绘制原点的 x 偏移, y 偏移)。"""
+        glyph = self.glyphs.get(label)
+        if glyph is None:
+            left, top, right, bottom = self.font.getbbox(label)
+            width, height = max(1, right - left), max(1, bottom - top)
+            mask = Image.new('L', (width, height), 0)
+            ImageDraw.Draw(mask).text((-left, -top), label, fill=255, font=self.font)
+            alpha = np.asarray(mask, dtype=np.float32)[:, :, None] / 255.0
+            glyph = (alpha, left, top)
+            self.glyphs[label] = glyph
+        return glyph
+
+    def draw(self, frame, label, x, y):
+        """在帧上 (x, y) 处绘制文字（与 ImageDraw.text 的定位一致），原地修改 frame。"""
+        alpha, left, top = self._glyph(label)
+        height, width = alpha.shape[:2]
+        x0, y0 = int(x) + left, int(y) + top
+        # 裁剪到帧内
+        fx0, fy0 = max(x0, 0), max(y0, 0)
+        fx1, fy1 = min(x0 + width, frame.shape[1]), min(y0 + height, frame.shape[0])
+        if fx0 >= fx1 or fy0 >= fy1:
+            return frame
+        a = alpha[fy0 - y0:fy1 - y0, fx0 - x0:fx1 - x0]
+        region = frame[fy0:fy1, fx0:fx1]
+        region[:] = (region * (1.0 - a) + self.color_bgr * a).astype(np.uint8)
+        return frame
+
 def load_pinyin_mapping(file_path):
     """Load pinyin initials to Chinese names mapping from a file."""
     mapping = {}
+    if not os.path.exists(file_path):
+        return mapping
     with open(file_path, 'r', encoding='utf-8') as file:
         for line in file:
             line = line.strip()
@@ -67,45 +124,331 @@ def load_pinyin_mapping(file_path):
                 mapping[pinyin] = name
     return mapping
 
-def merge_video_audio(video_path, audio_path, output_path):
+class FaceEmbeddingIndex:
+    """
+    角色照片的持久化特征索引。
+
+    特征保存在 index_dir/embeddings.npy（float32，按内存映射方式加载），
+    index_dir/index.json 记录每张照片的 (大小, mtime, sha256) 以及它在矩阵中的行号。
+    照片未改动时直接复用特征，改动或新增的照片才重新做人脸检测。
+    特征按照片内容的 sha256 索引，多部影片可以共用同一个索引目录 (FACE_INDEX_DIR)。
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.embeddings_path = os.path.join(index_dir, "embeddings.npy")
+        self.meta_path = os.path.join(index_dir, "index.json")
+        self.files = {}  # 绝对路径 -> {'size', 'mtime_ns', 'sha256'}
+        self.rows = {}   # sha256 -> 行号，-1 表示该照片中没有检测到人脸
+        self.embeddings = None
+        if os.path.exists(self.meta_path) and os.path.exists(self.embeddings_path):
+            try:
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                self.files = meta.get("files", {})
+                self.rows = meta.get("rows", {})
+                self.embeddings = np.load(self.embeddings_path, mmap_mode='r')
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not read face index at {index_dir}, rebuilding: {e}")
+                self.files, self.rows, self.embeddings = {}, {}, None
+
+    def _file_hash(self, path):
+        """文件大小和 mtime 未变时直接返回记录的哈希，否则重新计算。"""
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        record = self.files.get(abs_path)
+        if record and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+            return record["sha256"], False
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self.files[abs_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest, True
+
+    def _embed(self, app, image_path):
+        character_img = cv2.imread(image_path)
+        if character_img is None:
+            print(f"Warning: Could not read image file: {image_path}")
+            return None
+        character_faces = app.get(character_img)
+        if not character_faces:
+            print(f"Warning: No face detected in character image: {image_path}")
+            return None
+        if len(character_faces) > 1:
+            print(f"Warning: Multiple faces ({len(character_faces)}) detected in character image: {image_path}. Using the first one.")
+        return character_faces[0].normed_embedding.astype(np.float32)
+
+    def save(self, new_embeddings):
+        """
+        写回索引。只保留仍被某张现存照片引用的特征行并重新编号，
+        已删除或已改动的照片留下的旧特征随之清除，共享的索引不会无限增长。
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        live = {record["sha256"] for record in self.files.values()}
+        parts = []
+        if self.embeddings is not None and len(self.embeddings) > 0:
+            parts.append(np.array(self.embeddings))
+        if new_embeddings:
+            parts.append(np.stack(new_embeddings))
+        total = sum(len(part) for part in parts)
+
+        rows = {}
+        keep = []
+        for digest, row in self.rows.items():
+            if digest not in live:
+                continue
+            if row < 0:
+                rows[digest] = -1
+            else:
+                rows[digest] = len(keep)
+                keep.append(row)
+        self.rows = rows
+
+        if parts and (new_embeddings or len(keep) != total):
+            stacked = np.concatenate(parts)[keep]
+            self.embeddings = None # 释放内存映射，否则 Windows 上无法替换该文件
+            temp_path = self.embeddings_path + ".tmp.npy"
+            np.save(temp_path, stacked)
+            os.replace(temp_path, self.embeddings_path)
+            self.embeddings = np.load(self.embeddings_path, mmap_mode='r')
+            if len(keep) != total:
+                print(f"Face index compacted: {total - len(keep)} stale embeddings removed ({self.index_dir})")
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": self.files, "rows": self.rows}, f, ensure_ascii=False)
+        os.replace(temp_path, self.meta_path)
+
+    def load_bank(self, app, bank_path):
+        """
+        加载角色库：返回 (角色名列表, 归一化特征矩阵)，两者按行一一对应。
+        zh.txt 只读取一次，角色名在加载时映射，修改 zh.txt 不需要重新提取特征。
+        """
+        pinyin2name = load_pinyin_mapping(os.path.join(bank_path, "zh.txt"))
+        next_row = len(self.embeddings) if self.embeddings is not None else 0
+        new_embeddings = []
+        # 已不存在的照片从索引中移除，其特征在 save 时清除
+        removed = [path for path in self.files if not os.path.exists(path)]
+        for path in removed:
+            del self.files[path]
+        changed = bool(removed)
+        names = []
+        digests = []
+        for file in sorted(os.listdir(bank_path)):
+            if not file.lower().endswith((".png", ".jpg", ".jpeg")):
+                continue
+            character_img_path = os.path.join(bank_path, file)
+            character_name_base = os.path.splitext(file)[0]
+            try:
+                digest, rehashed = self._file_hash(character_img_path)
+                changed = changed or rehashed
+                if digest not in self.rows:
+                    embedding = self._embed(app, character_img_path)
+                    if embedding is None:
+                        self.rows[digest] = -1
+                    else:
+                        self.rows[digest] = next_row
+                        new_embeddings.append(embedding)
+                        next_row += 1
+                    changed = True
+            except Exception as e:
+                print(f"Error processing character image {character_img_path}: {e}")
+                continue
+
+            row = self.rows[digest]
+            if row < 0:
+                continue
+            if character_name_base in pinyin2name:
+                character_name = pinyin2name[character_name_base]
+            else:
+                print(f"Warning: Pinyin '{character_name_base}' not found in zh.txt, using filename as label.")
+                character_name = character_name_base
+            names.append(character_name)
+            digests.append(digest)
+
+        if changed:
+            self.save(new_embeddings)
+            print(f"Face index updated: {len(new_embeddings)} new embeddings, {len(self.embeddings) if self.embeddings is not None else 0} total ({self.index_dir})")
+
+        if not digests:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        # save 可能重新编号，按照片哈希取行号
+        return names, np.asarray(self.embeddings[[self.rows[digest] for digest in digests]], dtype=np.float32)
+
+
+def recognize_faces_batch(app, frames, bank_names, bank_matrix, include_unknown=False):
     """
-    使用 FFmpeg 将视频和音频合并为一个新的视频文件。
+    批量识别多帧中的人脸。逐帧做检测后，把整批帧中的所有人脸对齐并堆叠，
+    一次前向得到全部特征，再用一次矩阵乘法加 argmax 与角色库匹配。
 
     Args:
-        video_path: 视频文件的路径。
-        audio_path: 音频文件的路径。
-        output_path: 合并后的视频文件的保存路径。
+        app: 已初始化的 FaceAnalysis。
+        frames (list): BGR 帧列表。
+        bank_names (list): 角色名，与 bank_matrix 的行一一对应。
+        bank_matrix (np.ndarray): (角色数, 特征维度) 的归一化特征矩阵。
+        include_unknown (bool): 为 True 时也返回未匹配到角色的人脸，其 label 为 None。
+
+    Returns:
+        list: 与 frames 等长，每项为该帧中识别出的 [{'bbox': bbox, 'label': label}, ...]。
+    """
+    det_model = app.det_model
+    rec_model = app.models['recognition']
+    crop_size = rec_model.input_size[0]
+
+    results = [[] for _ in frames]
+    crops = []
+    owners = [] # (帧序号, bbox)
+    for index, frame in enumerate(frames):
+        bboxes, kpss = det_model.detect(frame, max_num=0, metric='default')
+        if bboxes is None or kpss is None:
+            continue
+        for bbox, kps in zip(bboxes, kpss):
+            crops.append(face_align.norm_crop(frame, landmark=kps, image_size=crop_size))
+            owners.append((index, bbox[:4].astype(int)))
+
+    if not crops:
+        return results
+
+    feats = rec_model.get_feat(crops)
+    feats = feats / np.linalg.norm(feats, axis=1, keepdims=True)
+    sims = feats @ bank_matrix.T
+    best = np.argmax(sims, axis=1)
+    best_sims = sims[np.arange(len(best)), best]
+    for (index, bbox), match, sim in zip(owners, best, best_sims):
+        if sim > SIMILARITY_THRESHOLD:
+            results[index].append({'bbox': bbox, 'label': f"{bank_names[match]}"})
+        elif include_unknown:
+            results[index].append({'bbox': bbox, 'label': None})
+    return results
+
+def bbox_iou(boxes_a, boxes_b):
+    """计算两组 [x1, y1, x2, y2] 框两两之间的 IoU，返回 (len(a), len(b)) 的矩阵。"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)[None, :, :]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+class FaceTracker:
+    """
+    在两次检测之间跟踪人脸。检测帧上用 IoU 把新检测结果与已有轨迹关联，
+    识别分数暂时低于阈值的人脸可以沿用轨迹上的角色名；非检测帧上用
+    Lucas-Kanade 光流估计每个框的位移，使标注跟随人脸移动。
+    """
+
+    def __init__(self):
+        self.tracks = [] # [{'bbox': float32 [x1, y1, x2, y2], 'label': str 或 None}]
+        self.prev_gray = None
+
+    def reset(self):
+        self.tracks = []
+
+    def update(self, frame, detections):
+        """用检测帧的结果更新轨迹。detections 为 recognize_faces_batch(include_unknown=True) 的单帧结果。"""
+        new_tracks = [{'bbox': np.asarray(d['bbox'], dtype=np.float32), 'label': d['label']} for d in detections]
+        if self.tracks and new_tracks:
+            iou = bbox_iou([t['bbox'] for t in new_tracks], [t['bbox'] for t in self.tracks])
+            # 按 IoU 从大到小贪心匹配
+            used_detections, used_tracks = set(), set()
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                d, t = np.unravel_index(flat, iou.shape)
+                if iou[d, t] < TRACK_IOU_THRESHOLD:
+                    break
+                if d in used_detections or t in used_tracks:
+                    continue
+                used_detections.add(d)
+                used_tracks.add(t)
+                if new_tracks[d]['label'] is None:
+                    new_tracks[d]['label'] = self.tracks[t]['label']
+        self.tracks = new_tracks
+        self.prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    def predict(self, frame):
+        """在非检测帧上用光流平移各轨迹的框；大部分特征点跟丢的轨迹会被丢弃。"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.prev_gray is not None and self.tracks:
+            kept = []
+            for track in self.tracks:
+                x1, y1, x2, y2 = track['bbox']
+                xs = np.linspace(x1, x2, 6)[1:-1]
+                ys = np.linspace(y1, y2, 6)[1:-1]
+                points = np.array([[x, y] for y in ys for x in xs], dtype=np.float32).reshape(-1, 1, 2)
+                next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None, winSize=(15, 15), maxLevel=2)
+                good = status.reshape(-1) == 1
+                if good.sum() < len(good) / 2:
+                    continue
+                shift = np.median((next_points - points).reshape(-1, 2)[good], axis=0)
+                track['bbox'] = track['bbox'] + np.array([shift[0], shift[1], shift[0], shift[1]], dtype=np.float32)
+                kept.append(track)
+            self.tracks = kept
+        self.prev_gray = gray
+
+    def boxes_and_labels(self):
+        return [{'bbox': t['bbox'].astype(int), 'label': t['label']} for t in self.tracks if t['label']]
+
+class FFmpegPipeWriter:
+    """
+    把原始 BGR 帧通过管道写入一个 ffmpeg 进程，在同一遍中完成 H.264 编码和音频复用，
+    不再生成临时视频文件。接口与 cv2.VideoWriter 相同 (isOpened/write/release)。
     """
-    try:
-        # 构建 FFmpeg 命令
+
+    def __init__(self, output_path, audio_path, fps, frame_size):
+        width, height = frame_size
         command = [
-            "ffmpeg",
-            "-i", video_path,
+            "ffmpeg", "-y",
+            "-loglevel", "error",
+            "-f", "rawvideo",
+            "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}",
+            "-r", str(fps),
+            "-i", "-",          # 视频帧来自标准输入
             "-i", audio_path,
-            "-c:v", "copy",  # 使用 'copy' 编解码器直接复制视频
-            "-c:a","libopus",
-            '-ac','1',
-            "-b:a","1k",
-            "-map", "0:v:0",  # 选择第一个参数的第一个视频流
-            "-map", "1:a:0",  # 选择第二个参数的第一个音频流
-            "-shortest",       # 以最短的流为准
+            "-map", "0:v:0",    # 选择管道中的视频流
+            "-map", "1:a:0",    # 选择音频文件的第一个音频流
+            "-c:v", "libx264",
+            "-crf", "28",
+            "-pix_fmt", "yuv420p",
+            "-g", str(max(1, int(round(fps * KEYFRAME_INTERVAL)))), # 固定关键帧间隔，后续分段可直接流复制
+            "-c:a", "libopus",
+            "-ac", "1",
+            "-b:a", "1k",
+            "-shortest",        # 以最短的流为准
             output_path
         ]
-
-        # 执行 FFmpeg 命令
-        subprocess.run(command, check=True, capture_output=True, text=True)
-
-        print(f"视频和音频已成功合并并保存到：{output_path}")
-
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg 合并视频和音频时发生错误：")
-        print(f"返回码: {e.returncode}")
-        print(f"标准输出: {e.stdout}")
-        print(f"标准错误: {e.stderr}")
-    except FileNotFoundError:
-        print("错误: FFmpeg 未找到。请确保已安装 FFmpeg 并将其添加到系统环境变量中。")
-    except Exception as e:
-        print(f"合并视频和音频时发生未知错误：{e}")
+        self.output_path = output_path
+        # stderr 写到临时文件而不是管道：写帧期间没有人读 stderr，管道写满后 ffmpeg 与本进程会互相阻塞
+        self.stderr_file = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.stderr_file)
+        except FileNotFoundError:
+            print("错误: FFmpeg 未找到。请确保已安装 FFmpeg 并将其添加到系统环境变量中。")
+            self.process = None
+            self.stderr_file.close()
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, frame):
+        self.process.stdin.write(frame.tobytes())
+
+    def release(self):
+        """关闭管道并等待编码结束，成功返回 True。"""
+        if self.process is None:
+            return False
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.stderr_file.seek(0)
+        stderr = self.stderr_file.read()
+        self.stderr_file.close()
+        if self.process.returncode != 0:
+            print(f"FFmpeg 编码视频时发生错误 (返回码 {self.process.returncode})：{stderr.decode(errors='replace')}")
+            return False
+        print(f"视频和音频已成功编码并保存到：{self.output_path}")
+        return True
 
 
 def character_recognition(input_video_path, audio_path,output_video_path,CHARACTER_BANK_PATH):
@@ -115,7 +458,9 @@ def character_recognition(input_video_path, audio_path,output_video_path,CHARACT
 
     Args:
         input_video_path (str): Path to the input video file (e.g., .mp4).
-        temp_video_path (str): Path where the annotated output video will be saved.
+        audio_path (str): Path to the audio track muxed into the output video.
+        output_video_path (str): Path where the annotated output video will be saved.
+        CHARACTER_BANK_PATH (str): Directory holding the character photos and zh.txt.
 
     Returns:
         bool: True if processing completed successfully, False otherwise.
@@ -127,67 +472,27 @@ def character_recognition(input_video_path, audio_path,output_video_path,CHARACT
         print("Error: FaceAnalysis model is not initialized. Cannot proceed.")
         return False
     
-    temp_video_path="temp_no_voice.mp4"
     print("-" * 20)
     print(f"Starting character recognition for: {input_video_path}")
-    print(f"Output will be saved to: {temp_video_path}")
+    print(f"Output will be saved to: {output_video_path}")
     print(f"Using character bank: {CHARACTER_BANK_PATH}")
     print(f"Similarity Threshold: {SIMILARITY_THRESHOLD}")
     print("-" * 20)
 
-    zh_txt_path=os.path.join(CHARACTER_BANK_PATH,"zh.txt")
-
-    # --- Character Bank Loading (Inside Function) ---
-    character_feats = {}
-    character_names = []
+    # --- Character Bank Loading (from the persistent embedding index) ---
     print("Loading character bank...")
     if not os.path.isdir(CHARACTER_BANK_PATH):
         print(f"Error: Character bank path not found: {CHARACTER_BANK_PATH}")
         return False
 
-    loaded_count = 0
-    for file in os.listdir(CHARACTER_BANK_PATH):
-        if file.lower().endswith((".png", ".jpg", ".jpeg")):
-            character_name_base = os.path.splitext(file)[0]
-            character_img_path = os.path.join(CHARACTER_BANK_PATH, file)
-            pinyin2name=load_pinyin_mapping(zh_txt_path)
-            if character_name_base in pinyin2name:
-                character_name=pinyin2name[character_name_base]
-            else:
-                print(f"Warning: Pinyin '{character_name_base}' not found in zh.txt, using filename as label.")
-                character_name = character_name_base
-
-            try:
-                character_img = cv2.imread(character_img_path)
-                if character_img is None:
-                    print(f"Warning: Could not read image file: {character_img_path}")
-                    continue
-
-                character_faces = app.get(character_img)
-
-                if character_faces and len(character_faces) == 1:
-                    character_feats[character_name] = character_faces[0].normed_embedding
-                    character_names.append(character_name)
-                    loaded_count += 1
-                    # print(f"  Loaded character: {character_name}") # Optional: Verbose loading
-                elif not character_faces:
-                    print(f"Warning: No face detected in character image: {character_img_path}")
-                else:
-                    print(f"Warning: Multiple faces ({len(character_faces)}) detected in character image: {character_img_path}. Using the first one.")
-                    character_feats[character_name] = character_faces[0].normed_embedding
-                    character_names.append(character_name)
-                    loaded_count += 1
-                    # print(f"  Loaded character (first face): {character_name}") # Optional
-
-            except Exception as e:
-                print(f"Error processing character image {character_img_path}: {e}")
+    index_dir = FACE_INDEX_DIR or CHARACTER_BANK_PATH + "_index"
+    character_names, bank_matrix = FaceEmbeddingIndex(index_dir).load_bank(app, CHARACTER_BANK_PATH)
 
-    if loaded_count == 0:
+    if len(character_names) == 0:
         print("Error: No character features loaded from the bank. Cannot proceed.")
         return False
     else:
-        print(f"Character bank loaded successfully. {loaded_count} characters found.")
-
+        print(f"Character bank loaded successfully. {len(character_names)} characters found.")
 
     # --- Video Processing ---
     print(f"Opening video file: {input_video_path}")
@@ -209,124 +514,114 @@ def character_recognition(input_video_path, audio_path,output_video_path,CHARACT
 
     print(f"Video properties: {frame_width}x{frame_height} @ {fps:.2f} FPS, Total Frames: {total_frames if total_frames > 0 else 'Unknown'}")
 
-    # Define the codec and create VideoWriter object
+    # Create the streaming writer (encodes and muxes the audio in one pass)
     # Ensure the output directory exists
-    output_dir = os.path.dirname(temp_video_path)
+    output_dir = os.path.dirname(output_video_path)
     if output_dir and not os.path.exists(output_dir):
         print(f"Creating output directory: {output_dir}")
         os.makedirs(output_dir)
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v') # Codec for .mp4
-    out = cv2.VideoWriter(temp_video_path, fourcc, fps, (frame_width, frame_height))
+    out = FFmpegPipeWriter(output_video_path, audio_path, fps, (frame_width, frame_height))
 
     if not out.isOpened():
-         print(f"Error: Could not open VideoWriter for path: {temp_video_path}")
+         print(f"Error: Could not start ffmpeg writer for path: {output_video_path}")
          cap.release()
          return False
 
 
-    print(f"Processing video and saving to: {temp_video_path}")
+    print(f"Processing video and saving to: {output_video_path}")
+    label_renderer = LabelRenderer()
     frame_count = 0
     start_time = time.time()
     success = True # Flag to track overall success
 
     try: # Use try...finally to ensure resources are released
-        skip_frames = 2   #为2时， 处理 1 帧，跳过 1 帧 (可以调整这个值)
-        last_known_faces = {} # 存储 {face_id: {'bbox': bbox, 'label': label}} 或类似结构 (更复杂的跟踪可能需要)
-                                 # 简单实现：存储上一帧所有绘制信息
-        previous_boxes_and_labels = []
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                print("Reached end of video or error reading frame.")
+        tracker = FaceTracker()
+        frames_since_detection = DETECTION_INTERVAL # 保证第一帧做检测
+        previous_hist = None
+        scene_cuts = 0
+        recognition_time = 0.0 # 识别耗时，用于统计批量识别的吞吐量
+        recognized_frames = 0 # 即检测器调用次数
+        reached_end = False
+        while not reached_end:
+            # --- 读取一批帧 ---
+            batch = []
+            while len(batch) < RECOGNITION_BATCH_SIZE:
+                ret, frame = cap.read()
+                if not ret:
+                    print("Reached end of video or error reading frame.")
+                    reached_end = True
+                    break
+                batch.append(frame)
+            if not batch:
                 break
 
-            frame_count += 1
-            processed_frame = frame # processed_frame = frame.copy() #Work on a copy to keep original frame clean if needed
-
-            current_boxes_and_labels = [] # 存储当前帧要绘制的信息
-
-            # --- 只在采样帧上进行检测和识别 ---
-            if frame_count % skip_frames == 0:
-                previous_boxes_and_labels = [] # 清空上一帧的结果，准备更新
-                # --- Face Detection and Recognition on the current frame ---
-                try:
-                    input_faces = app.get(processed_frame) # Use the copy
-
-                    if input_faces:
-                        for face in input_faces:
-                            feat = face.normed_embedding
-                            max_sim = -1
-                            best_match = "Unknown"
-
-                            for name, char_feat in character_feats.items():
-                                sim = np.dot(feat, char_feat)
-                                if sim > max_sim:
-                                    max_sim = sim
-                                    if sim > SIMILARITY_THRESHOLD:
-                                        best_match = name
-                                        # --- Bounding Box and Label ---
-                                        bbox = face.bbox.astype(int)
-                                        label = f"{best_match}"
-                                        # 存储当前帧的结果
-                                        current_boxes_and_labels.append({'bbox': bbox, 'label': label})
-                                        previous_boxes_and_labels.append({'bbox': bbox, 'label': label}) # 更新用于跳过帧的结果
-                                    else:
-                                        best_match = "Unknown" # Reset if below threshold
-                except Exception as e:
-                    print(f"Error processing frame {frame_count}: {e}")
-                    # 如果处理失败，可以选择也清空上一帧结果，避免错误信息被传播
-                    previous_boxes_and_labels = []
-                    current_boxes_and_labels = []
-            else:
-                # --- 对于跳过的帧，使用上一帧的结果 ---
-                current_boxes_and_labels = previous_boxes_and_labels
-
-            # --- 统一绘制 ---
-            # 无论是否是采样帧，都根据 current_boxes_and_labels 绘制
-            for item in current_boxes_and_labels:
-                bbox = item['bbox']
-                label = item['label']
-
-                # Convert OpenCV image to PIL Image
-                pil_image = Image.fromarray(cv2.cvtColor(processed_frame, cv2.COLOR_BGR2RGB))
-                draw = ImageDraw.Draw(pil_image)
-
-                try:
-                    font = ImageFont.truetype(FONT_PATH, FONT_SIZE)
-                except IOError:
-                    print(f"Error: Could not load font at {FONT_PATH}. Using default font.")
-                    font = ImageFont.load_default()
-
-                text_x = bbox[0]
-                text_y = bbox[1] - FONT_SIZE - 5
-                if text_y < 0:
-                    text_y = bbox[3] + 5
-
-                # processed_frame = draw_text_freetype(processed_frame, label, (text_x, text_y), TEXT_COLOR, font_face, FONT_SIZE)#使用freetype
-
-                # Draw bounding box
-                # draw.rectangle([(bbox[0], bbox[1]), (bbox[2], bbox[3])], outline=BOX_COLOR, width=2)#为提升效率，选择每三帧（1s）采样一帧，若后两帧的边框与第一帧一致，会出现与人物面部对不上的情况
-
-                # Draw text with Pillow
-                draw.text((text_x, text_y), label, fill=TEXT_COLOR, font=font)
-
-                # Convert PIL Image back to OpenCV image
-                processed_frame = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-
-            # --- Write the processed frame ---
-            out.write(processed_frame)
-
-            # --- Progress Update ---
-            if frame_count % 100 == 0: # Update progress less frequently for video
-                elapsed_time = time.time() - start_time
-                fps_proc = frame_count / elapsed_time if elapsed_time > 0 else 0
-                if total_frames > 0:
-                    print(f"  Processed frame {frame_count}/{total_frames} ({fps_proc:.2f} FPS)")
+            # --- 决定哪些帧做检测：每隔 DETECTION_INTERVAL 帧一次，镜头切换时立即检测 ---
+            detect_indices = []
+            cut_indices = set()
+            for i, frame in enumerate(batch):
+                hist = frame_histogram(frame)
+                if previous_hist is not None and histogram_similarity(previous_hist, hist) < SCENE_CUT_THRESHOLD:
+                    cut_indices.add(i)
+                    scene_cuts += 1
+                previous_hist = hist
+                frames_since_detection += 1
+                if i in cut_indices or frames_since_detection >= DETECTION_INTERVAL:
+                    detect_indices.append(i)
+                    frames_since_detection = 0
+
+            # --- 检测帧整批一起完成检测和识别 ---
+            batch_start = time.time()
+            try:
+                detect_results = recognize_faces_batch(app, [batch[i] for i in detect_indices], character_names, bank_matrix, include_unknown=True)
+            except Exception as e:
+                print(f"Error processing frames {frame_count + 1}-{frame_count + len(batch)}: {e}")
+                # 如果处理失败，清空结果，避免错误信息被传播
+                detect_results = [[] for _ in detect_indices]
+            recognition_time += time.time() - batch_start
+            recognized_frames += len(detect_indices)
+            results_by_index = dict(zip(detect_indices, detect_results))
+
+            for i, processed_frame in enumerate(batch):
+                frame_count += 1
+                # 检测帧更新轨迹，其余帧由光流推算位置（须在绘制之前，避免文字干扰光流）
+                if i in results_by_index:
+                    if i in cut_indices:
+                        tracker.reset()
+                    tracker.update(processed_frame, results_by_index[i])
                 else:
-                    print(f"  Processed frame {frame_count} ({fps_proc:.2f} FPS)")
-        
-        
+                    tracker.predict(processed_frame)
+                current_boxes_and_labels = tracker.boxes_and_labels()
+
+                # --- 统一绘制 ---
+                # 无论是否是检测帧，都根据 current_boxes_and_labels 绘制
+                for item in current_boxes_and_labels:
+                    bbox = item['bbox']
+                    label = item['label']
+
+                    text_x = bbox[0]
+                    text_y = bbox[1] - FONT_SIZE - 5
+                    if text_y < 0:
+                        text_y = bbox[3] + 5
+
+                    # Draw bounding box
+                    # draw.rectangle([(bbox[0], bbox[1]), (bbox[2], bbox[3])], outline=BOX_COLOR, width=2)#为提升效率，选择每三帧（1s）采样一帧，若后两帧的边框与第一帧一致，会出现与人物面部对不上的情况
+
+                    # 直接把缓存的文字位图混合到帧上，不再做整帧颜色转换
+                    label_renderer.draw(processed_frame, label, text_x, text_y)
+
+                # --- Write the processed frame ---
+                out.write(processed_frame)
+
+                # --- Progress Update ---
+                if frame_count % 100 == 0: # Update progress less frequently for video
+                    elapsed_time = time.time() - start_time
+                    fps_proc = frame_count / elapsed_time if elapsed_time > 0 else 0
+                    fps_recog = recognized_frames / recognition_time if recognition_time > 0 else 0
+                    if total_frames > 0:
+                        print(f"  Processed frame {frame_count}/{total_frames} ({fps_proc:.2f} FPS, recognition {fps_recog:.2f} FPS)")
+                    else:
+                        print(f"  Processed frame {frame_count} ({fps_proc:.2f} FPS, recognition {fps_recog:.2f} FPS)")
 
     except Exception as e:
         print(f"An unexpected error occurred during video processing: {e}")
@@ -335,7 +630,8 @@ def character_recognition(input_video_path, audio_path,output_video_path,CHARACT
         # --- Cleanup ---
         print("Releasing video resources...")
         cap.release()
-        out.release()
+        if not out.release():
+            success = False
 
         end_time = time.time()
         total_time = end_time - start_time
@@ -343,14 +639,18 @@ def character_recognition(input_video_path, audio_path,output_video_path,CHARACT
         print(f"Finished processing video. Processed {frame_count} frames.")
         print(f"Total processing time: {total_time:.2f} seconds")
         print(f"Average processing FPS: {avg_fps:.2f}")
+        if recognition_time > 0:
+            print(f"Batched recognition FPS: {recognized_frames / recognition_time:.2f} ({recognized_frames} frames, batch size {RECOGNITION_BATCH_SIZE})")
+        video_minutes = frame_count / fps / 60 if fps > 0 else 0
+        if video_minutes > 0:
+            print(f"Detector calls per minute of video: {recognized_frames / video_minutes:.1f} "
+                  f"(every frame: {fps * 60:.1f}; interval {DETECTION_INTERVAL}, {scene_cuts} scene cuts)")
         if success and frame_count > 0:
-             print(f"Output video successfully saved to: {temp_video_path}")
+             print(f"Output video successfully saved to: {output_video_path}")
         elif frame_count == 0 and success:
              print("Warning: No frames were processed (Input video might be empty or unreadable after opening).")
              success = False # Consider this not fully successful
         else:
-             print(f"Video processing failed or encountered errors. Output file might be incomplete or corrupted: {temp_video_path}")
-    
-    merge_video_audio(temp_video_path,audio_path,output_video_path)
-    os.remove(temp_video_path)
+             print(f"Video processing failed or encountered errors. Output file might be incomplete or corrupted: {output_video_path}")
+
     return success
\ No newline at end of file
@@ -1,59 +1,135 @@
-import csv
 import os
+import wave
 
+import numpy as np
 from funasr import AutoModel
 
+import intervals
+import timeline
+
+VAD_MODEL = "iic/speech_fsmn_vad_zh-cn-16k-common-pytorch"
+VAD_SAMPLE_RATE = 16000
+VAD_CHUNK_MS = 5000 # 流式处理时每次送入模型的音频长度（毫秒），内存占用与影片长度无关
+# 默认的对白间隙策略，fsmn_vad / speech_gaps 的参数可按影片覆盖
+MIN_GAP = 2 # 对白间隙的最小长度（秒）
+SPEECH_JOIN = 0.0 # 间隔不超过该值的语音段视为同一段（秒）
+GAP_PAD = 0.0 # 语音结束后到间隙开始之间保留的余量（秒）
+GAP_LOOKAHEAD = 0.0 # 间隙结束与下一段语音之间预留的余量（秒）
+
+
+class VADService:
+    """
+    FSMN VAD 服务。模型只在第一次使用时加载一次，之后在多部影片之间复用；
+    音频按 VAD_CHUNK_MS 分块流式送入模型，语音段一结束就立即产出。
+    """
+
+    def __init__(self, model_name=VAD_MODEL, chunk_ms=VAD_CHUNK_MS):
+        self.model_name = model_name
+        self.chunk_ms = chunk_ms
+        self.model = None
+
+    def get_model(self):
+        if self.model is None:
+            print("Initializing FSMN VAD model...")
+            self.model = AutoModel(model=self.model_name, disable_update=True, disable_pbar=True)
+        return self.model
+
+    def stream_segments(self, audio_path):
+        """
+        逐段产出语音段 (起始秒, 结束秒)。
+
+        16kHz 单声道 PCM WAV 按块读取并流式检测；其他格式交给模型整体处理（会整体重采样）。
+        """
+        model = self.get_model()
+        with wave.open(audio_path, 'rb') as wav:
+            streamable = (wav.getframerate() == VAD_SAMPLE_RATE and wav.getnchannels() == 1 and wav.getsampwidth() == 2)
+            total_frames = wav.getnframes()
+            if streamable:
+                chunk_frames = int(VAD_SAMPLE_RATE * self.chunk_ms / 1000)
+                cache = {}
+                pending_start = None
+                read_frames = 0
+                while read_frames < total_frames:
+                    data = wav.readframes(chunk_frames)
+                    if not data:
+                        break
+                    read_frames += len(data) // 2
+                    chunk = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+                    is_final = read_frames >= total_frames
+                    res = model.generate(input=chunk, cache=cache, is_final=is_final, chunk_size=self.chunk_ms)
+                    # 流式结果中 -1 表示该端点尚未出现在本块中
+                    for beg, end in res[0]["value"]:
+                        if beg != -1:
+                            pending_start = beg
+                        if end != -1 and pending_start is not None:
+                            yield pending_start / 1000, end / 1000
+                            pending_start = None
+                if pending_start is not None:
+                    yield pending_start / 1000, total_frames / VAD_SAMPLE_RATE
+                return
+
+        print(f"警告: {audio_path} 不是 16kHz 单声道 PCM，改为整体检测。")
+        res = model.generate(input=audio_path)
+        for beg, end in res[0]["value"]:
+            yield beg / 1000, end / 1000
+
+
+vad_service = None
+def get_global_vad_service():
+    global vad_service
+    if vad_service is None:
+        vad_service = VADService()
+    return vad_service
+
+
+def stream_gaps(audio_path, speech_rows=None, min_gap=MIN_GAP, pad=GAP_PAD, lookahead=GAP_LOOKAHEAD, max_join=SPEECH_JOIN):
+    """
+    流式检测并逐个产出对白间隙 (起始, 时长)：每段语音一结束、下一段语音一开始，
+    它们之间的间隙就立即产出。speech_rows 给出时，检测到的语音段（保留一位小数）依次追加到其中。
+
+    Args:
+        min_gap (float): 间隙需严格长于该值（秒）才保留。
+        pad (float): 语音结束后到间隙开始之间保留的余量（秒）。
+        lookahead (float): 间隙结束与下一段语音之间预留的余量（秒）。
+        max_join (float): 间隔不超过该值的语音段视为同一段（秒）。
+    """
+    service = get_global_vad_service()
+    def spans():
+        for start, end in service.stream_segments(audio_path):
+            row = (round(start, 1), round(end, 1))
+            if speech_rows is not None:
+                speech_rows.append(row)
+            yield row
+    return intervals.iter_gaps(spans(), min_gap=min_gap, pad=pad, lookahead=lookahead, max_join=max_join)
+
+def fsmn_vad(audio_path, min_gap=MIN_GAP, pad=GAP_PAD, lookahead=GAP_LOOKAHEAD, max_join=SPEECH_JOIN):
+    """
+    检测语音段并计算对白间隙，间隙随检测进度逐个得到。间隙策略参数见 stream_gaps。
+
+    Returns:
+        tuple: (语音段, 对白间隙)，均为 timeline.Timeline；未检测到语音时返回 (None, None)。
+    """
+    vad_rows=[]
+    gap_rows=[]
+    for gap in stream_gaps(audio_path, vad_rows, min_gap, pad, lookahead, max_join):
+        print(f"对白间隙: {gap[0]}s，时长 {gap[1]}s")
+        gap_rows.append(gap)
 
-def fsmn_vad(audio_path,vad_file_path,gap_file_path):
-    # from funasr import AutoModel
-    model = AutoModel(model="iic/speech_fsmn_vad_zh-cn-16k-common-pytorch",disable_update=True)
-    res = model.generate(input=audio_path)
-    # print(res[0])
-    vad_data=res[0]["value"]# 从fsmn-vad得到的时间戳
-    #print(vad_data)
-    
     # kongzhipanding
-    if not vad_data:
+    if not vad_rows:
         print("无间隙点。")
-        return
-    
-    #处理vad数据
-    processed_vad_data=[]
-    for row in vad_data:
-        # 除以 1000 并四舍五入保留一位小数
-        processed_vad_data.append([round(row[0] / 1000, 1),round(row[1] / 1000, 1)])
-
-    #将vad数据写入文件
-    try:
-        with open(vad_file_path, 'w', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile)
-            csv_writer.writerows(processed_vad_data)
-        print(f"已将voice activity detection数据写入到文件: {vad_file_path}")
-    except Exception as e:
-        print(f"voice activity detection数据写入 CSV 文件时发生错误: {e}")
-
-    #根据vad数据得到gap数据，并将gap数据写入文件
-    gap_data=[]
-    if processed_vad_data[0][0]>2:gap_data.append([0.0,processed_vad_data[0][0]])
-    newstart= processed_vad_data[0][1]
-    i=1
-    j=0
-    while i<len(processed_vad_data):
-        if processed_vad_data[i][0]-processed_vad_data[j][1]>2 :
-            gap_data.append([newstart,round(processed_vad_data[i][0]-processed_vad_data[j][1],1)])
-        newstart=processed_vad_data[i][1]
-        i+=1
-        j+=1
-
-
-    with open(gap_file_path, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        #writer.writerow(['start_time(s)', 'duration(s)'])
-        writer.writerows(gap_data)
-
-    print(gap_data)
+        return None, None
+    speech=timeline.Timeline.from_spans(vad_rows)
+    gaps=timeline.Timeline(*zip(*gap_rows)) if gap_rows else timeline.Timeline()
+    print(f"voice activity detection 检测到 {len(speech)} 个语音段，对白间隙 {len(gaps)} 个")
+    return speech, gaps
+
+def speech_gaps(speech, min_gap=MIN_GAP, pad=GAP_PAD, lookahead=GAP_LOOKAHEAD, max_join=SPEECH_JOIN):
+    """由语音段时间轴计算对白间隙时间轴（与 fsmn_vad 流式得到的间隙相同），间隙策略参数见 stream_gaps。"""
+    gap_rows=list(intervals.iter_gaps(speech.spans(), min_gap=min_gap, pad=pad, lookahead=lookahead, max_join=max_join))
+    return timeline.Timeline(*zip(*gap_rows)) if gap_rows else timeline.Timeline()
 
 
 
 if __name__=="__main__":
-    fsmn_vad(r"D:\Thunder\BloodyBattleTaierzhuang_0419test\BloodyBattleInTaierzhuang_1fps_30min.mp4")
\ No newline at end of file
+    speech, gaps = fsmn_vad(r"D:\Thunder\BloodyBattleTaierzhuang_0419test\BloodyBattleInTaierzhuang_1fps_30min_16k.wav")
@@ -1,188 +1,253 @@
-import csv
 import math  # 用于 ceil
 import os
 import subprocess
-import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
 
-def get_video_duration(video_path):
-    """使用 ffprobe 获取视频时长 (秒)"""
+import intervals
+import media_probe
+import timeline
+
+# 并行切割时同时运行的 ffmpeg 进程数 (libx264 自身也是多线程的，不宜过大)
+DEFAULT_SEGMENT_WORKERS = min(4, os.cpu_count() or 1)
+# 规划分割点时，在目标点前后多大范围（占段长的比例）内寻找静音
+BOUNDARY_SEARCH_RATIO = 0.1
+
+
+def get_keyframe_times(video_path):
+    """使用 ffprobe 获取视频第一条视频流中所有关键帧的时间戳 (秒)，按升序返回。"""
     command = [
         'ffprobe',
         '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
+        '-select_streams', 'v:0',
+        '-skip_frame', 'nokey',
+        '-show_entries', 'frame=pts_time',
+        '-of', 'csv=p=0',
         video_path
     ]
     try:
         result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True)
-        duration = float(result.stdout.strip())
-        return duration
-    except FileNotFoundError:
-        print(f"错误：找不到 'ffprobe' 命令。请确保 ffmpeg 已安装并在系统 PATH 中。")
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        print(f"错误：ffprobe 获取视频 '{video_path}' 时长失败。")
-        print(f"命令: {' '.join(command)}")
-        print(f"错误信息: {e.stderr}")
-        sys.exit(1)
-    except ValueError:
-        print(f"错误：无法将 ffprobe 的输出解析为时长。")
-        sys.exit(1)
-
-def split_video_by_thresholds(vad_file_path, video_file_path, output_dir, threshold_step=600):
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        print(f"警告：无法获取视频 '{video_path}' 的关键帧信息: {e}")
+        return []
+    keyframes = []
+    for line in result.stdout.splitlines():
+        line = line.strip().strip(',')
+        if not line:
+            continue
+        try:
+            keyframes.append(float(line))
+        except ValueError:
+            continue
+    return sorted(keyframes)
+
+def encode_segment(video_file_path, start_time, end_time, output_filepath, stream_copy=False):
+    """
+    切割单个视频片段。-ss 放在 -i 之前，使用输入端快速定位，不必从头解码。
+
+    Args:
+        stream_copy (bool): True 时直接复制码流（不重新编码），要求 start_time 位于关键帧上。
+    """
+    command = [
+        'ffmpeg', '-y', # Overwrite output files without asking
+        '-ss', str(start_time),
+        '-i', video_file_path,
+        '-t', str(end_time - start_time),
+    ]
+    if stream_copy:
+        command += [
+            '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero',
+        ]
+    else:
+        command += [
+            '-vf', 'scale=-2:360',
+            '-r', '1',
+            '-c:v', 'libx264',
+            '-crf','28',
+            '-c:a', 'libopus',
+            '-ac','1',
+            '-b:a', '1k',
+        ]
+    command.append(output_filepath)
+    subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return output_filepath
+
+def nearest_silence_cut(silence_cuts, target, previous, video_duration, max_distance):
+    """在 (previous, video_duration) 内离 target 不超过 max_distance 的静音切割点中取最近的一个，没有时返回 None。"""
+    valid = (silence_cuts > previous) & (silence_cuts < video_duration) & (np.abs(silence_cuts - target) <= max_distance)
+    if not valid.any():
+        return None
+    cuts = silence_cuts[valid]
+    return float(cuts[np.argmin(np.abs(cuts - target))])
+
+def plan_segment_boundaries(vad_spans, video_duration, target_length=600, search_ratio=BOUNDARY_SEARCH_RATIO, keyframes=None):
+    """
+    规划分割点：先按 target_length 估算段数并均分总时长，再在每个目标点前后
+    search_ratio 倍段长的范围内，选择最长的静音（越靠近目标点越优先），在静音开始处（对白结束处）切割。
+    每确定一个分割点都会按剩余时长重新均分，使各段时长接近，并行处理时不会被某一段拖慢。
+
+    给出 keyframes 时（流复制只能从关键帧开始），每段静音的切割点改为静音内的第一个关键帧，
+    不含关键帧的静音不作为候选；窗口内没有可用静音时，先放宽到半个段长内最近的可用静音，
+    仍然没有时才退回到目标点之后下一段对白开始前的最近关键帧。分割点因此总是关键帧，并尽量落在静音中。
+
+    Args:
+        vad_spans: VAD 语音段 [[起始, 结束], ...]。
+        video_duration (float): 视频总时长（秒）。
+        target_length (float): 目标段长（秒）。
+        search_ratio (float): 搜索窗口占段长的比例。
+        keyframes (list): 升序的关键帧时间戳（秒），为 None 时分割点不受关键帧限制。
+
+    Returns:
+        list: 升序的分割点（不含 0 和总时长）。
     """
-    根据 CSV 文件中的时间戳阈值分割视频，并返回分割点时间戳列表。
+    segment_count = max(1, int(round(video_duration / target_length)))
+    if segment_count == 1:
+        return []
+    spans = intervals.as_spans(vad_spans)
+    silences = intervals.compute_gaps(spans, min_gap=0.0, end_time=video_duration, decimals=None) # 各段语音之前的静音，以及最后一段语音之后的静音（如片尾）
+    silence_starts = silences['start']
+    silence_durations = silences['duration']
+    speech_starts = np.sort(spans[:, 0])
+    speech_ends = np.sort(spans[:, 1])
+
+    if keyframes is None:
+        silence_cuts = silence_starts
+    else:
+        keyframes = np.asarray(keyframes, dtype=np.float64)
+        # 每段静音内的第一个关键帧；静音内没有关键帧时为 inf，不会成为候选
+        first = np.searchsorted(keyframes, silence_starts, side='left')
+        silence_cuts = np.full(len(silence_starts), np.inf)
+        inside = first < len(keyframes)
+        silence_cuts[inside] = keyframes[first[inside]]
+        silence_cuts[silence_cuts > silence_starts + silence_durations] = np.inf
+
+    cut_points = []
+    previous = 0.0
+    for k in range(1, segment_count):
+        target = previous + (video_duration - previous) / (segment_count - k + 1)
+        window = target_length * search_ratio
+        lo, hi = np.searchsorted(silence_starts, [target - window, target + window])
+        candidates = np.arange(lo, hi)
+        candidates = candidates[(silence_cuts[candidates] > previous) & (silence_cuts[candidates] < video_duration)]
+        fallback = None
+        if not len(candidates) and keyframes is not None:
+            fallback = nearest_silence_cut(silence_cuts, target, previous, video_duration, target_length / 2)
+        if len(candidates):
+            distance = np.minimum(np.abs(silence_cuts[candidates] - target) / window, 1.0)
+            score = silence_durations[candidates] * (1.0 - 0.5 * distance)
+            best = candidates[np.argmax(score)]
+            cut = float(silence_cuts[best])
+            print(f"目标点 {target:.2f}s：在 {silence_starts[best]:.2f}s 处的 {silence_durations[best]:.2f}s 静音内的 {cut:.2f}s 切割")
+        elif keyframes is None:
+            # 窗口内没有静音，退回到目标点之后的第一个对白结束处
+            index = np.searchsorted(speech_ends, target)
+            cut = float(speech_ends[index]) if index < len(speech_ends) else target
+            print(f"目标点 {target:.2f}s：窗口内无静音，在 {cut:.2f}s 处切割")
+        elif fallback is not None:
+            # 窗口内没有含关键帧的静音，放宽到半个段长内离目标点最近的一个
+            cut = fallback
+            print(f"目标点 {target:.2f}s：窗口内无含关键帧的静音，在最近的 {cut:.2f}s 静音内切割")
+        else:
+            # 附近都没有含关键帧的静音，退回到目标点之后下一段对白开始前的最近关键帧
+            index = np.searchsorted(speech_starts, target)
+            speech_start = speech_starts[index] if index < len(speech_starts) else video_duration
+            index = np.searchsorted(keyframes, speech_start, side='right') - 1
+            if index < 0:
+                continue
+            cut = float(keyframes[index])
+            print(f"目标点 {target:.2f}s：窗口内无含关键帧的静音，在对白开始 {speech_start:.2f}s 前的关键帧 {cut:.2f}s 处切割")
+        if cut <= previous or cut >= video_duration:
+            continue
+        cut_points.append(cut)
+        previous = cut
+
+    lengths = np.diff([0.0] + cut_points + [video_duration])
+    print(f"分段规划: {len(lengths)} 段，时长 {np.round(lengths, 1).tolist()}")
+    return cut_points
+
+def split_video_by_thresholds(speech, video_file_path, output_dir, threshold_step=600, max_workers=DEFAULT_SEGMENT_WORKERS, stream_copy=False):
+    """
+    根据 VAD 结果规划分割点（选在目标段长附近最长的静音处）分割视频，并返回分割点时间戳列表。
+    先确定全部分割点，再用多个 ffmpeg 进程并行切割各片段，总耗时约等于最长片段的耗时。
 
     Args:
-        vad_file_path (str): VAD CSV 文件的路径。
+        speech (timeline.Timeline): VAD 检测出的语音段。
         video_file_path (str): 原始视频文件的路径。
         output_dir (str): 分割后视频片段的输出目录。
-        threshold_step (int): 时间阈值的步长 (例如 600 秒)。
+        threshold_step (int): 目标段长 (例如 600 秒)，实际分割点由 plan_segment_boundaries 选在静音处。
+        max_workers (int): 同时运行的 ffmpeg 进程数。
+        stream_copy (bool): True 时分割点选在静音内的关键帧上并直接复制码流，适用于已压缩的 _identified.mp4。
 
     Returns:
         list or None: 成功时返回分割点时间戳列表 [0.0, time1, time2, ..., video_duration]，
-                      失败时返回 None。
+                      任一片段分割失败时返回 None。
     """
     if not os.path.exists(video_file_path):
         print(f"错误：视频文件未找到: {video_file_path}")
         return None
 
-    if not os.path.exists(vad_file_path):
-        print(f"错误：CSV 文件未找到: {vad_file_path}")
-        return None
-
     # 创建输出目录 (如果不存在)
     os.makedirs(output_dir, exist_ok=True)
 
-    segment_timestamps = [0.0] # 初始化分割时间戳列表，包含起始点 0
-    video_duration = 0.0
-
     # 获取视频总时长
-    try:
-        video_duration = get_video_duration(video_file_path)
-        print(f"视频总时长: {video_duration:.2f} 秒")
-    except SystemExit:
+    source_info = media_probe.probe(video_file_path)
+    if source_info is None:
         return None
-
-    current_threshold = threshold_step
-    start_time = 0.0
-    segment_index = 1
-    found_split_point = False # 标记是否至少找到一个分割点
-
-    print(f"开始处理 VAD CSV 文件: {vad_file_path} 以分割视频")
-    try:
-        with open(vad_file_path, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            #header = next(reader, None) # 跳过表头
-            # print(f"CSV 表头 (已跳过): {header}" if header else "CSV 文件无表头") # Optional debug print
-
-            for i, row in enumerate(reader):
-                if len(row) < 2:
-                    # print(f"警告：VAD CSV 第 {i+2} 行数据列数不足，跳过。行内容: {row}") # Optional debug print
-                    continue
-
-                try:
-                    timestamp = float(row[1]) # 对白结束时间戳在第二列
-                except (ValueError, IndexError):
-                    # print(f"警告：VAD CSV 第 {i+2} 行的第二列无法解析为数字，跳过。行内容: {row}") # Optional debug print
-                    continue
-
-                # 检查是否达到或超过当前寻找的阈值
-                if timestamp >= current_threshold:
-                    end_time = timestamp
-                    output_filename = f"segment_{segment_index}.mp4"
-                    output_filepath = os.path.join(output_dir, output_filename)
-                    print(f"找到阈值点: {timestamp:.2f} (>= {current_threshold})。切割视频片段 {segment_index}: [{start_time:.2f}s - {end_time:.2f}s]")
-
-                    command = [
-                        'ffmpeg', '-y', # Overwrite output files without asking
-                        '-i', video_file_path,
-                        '-ss', str(start_time),
-                        '-to', str(end_time),
-                        '-vf', 'scale=-2:360',
-                        '-r', '1',
-                        '-c:v', 'libx264',
-                        '-crf','28',
-                        '-c:a', 'libopus',
-                        '-ac','1',
-                        '-b:a', '1k',
-                        output_filepath
-                    ]
-                    try:
-                        # print(f"执行命令: {' '.join(command)}") # Optional debug print
-                        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        print(f"视频片段已保存到: {output_filepath}")
-
-                        segment_timestamps.append(end_time) # 记录分割点
-                        found_split_point = True
-                        start_time = end_time
-                        segment_index += 1
-                        current_threshold += threshold_step
-
-                    except FileNotFoundError:
-                        print(f"错误：找不到 'ffmpeg' 命令。请确保已安装并在 PATH 中。")
-                        return None # 停止处理
-                    except subprocess.CalledProcessError as e:
-                        print(f"错误：ffmpeg 分割视频失败。")
-                        print(f"命令: {' '.join(command)}")
-                        print(f"错误信息: {e.stderr.decode()}")
-                        print("警告：上一个片段分割失败，将尝试继续处理。")
-                        # 即使失败，也记录时间戳并尝试继续
-                        segment_timestamps.append(end_time)
-                        found_split_point = True
-                        start_time = end_time
-                        segment_index += 1
-                        current_threshold += threshold_step
-
-    except FileNotFoundError:
-        print(f"错误：VAD CSV 文件打开失败: {vad_file_path}")
-        return None
-    except Exception as e:
-        print(f"读取 VAD CSV 文件时发生未知错误: {e}")
+    video_duration = source_info.duration
+    print(f"视频总时长: {video_duration:.2f} 秒")
+
+    # --- 确定分割点 ---
+    # 流复制只能从关键帧开始，分割点需选在关键帧上，否则片段时间轴与 gap 文件对不上
+    keyframes = (get_keyframe_times(video_file_path) or None) if stream_copy else None
+    print(f"根据 {len(speech)} 个语音段规划分割点" + (f"（流复制，候选关键帧 {len(keyframes)} 个）" if keyframes else ""))
+    cut_points = plan_segment_boundaries(speech.spans(), video_duration, threshold_step, keyframes=keyframes)
+
+    segment_timestamps = [0.0] + cut_points + [video_duration]
+
+    # --- 并行切割 ---
+    jobs = []
+    for index in range(len(segment_timestamps) - 1):
+        start_time = segment_timestamps[index]
+        end_time = segment_timestamps[index + 1]
+        if end_time <= start_time:
+            continue
+        output_filepath = os.path.join(output_dir, f"segment_{index + 1}.mp4")
+        jobs.append((start_time, end_time, output_filepath))
+
+    print(f"并行切割 {len(jobs)} 个视频片段 (并发数: {max_workers}, {'流复制' if stream_copy else '重新编码'})")
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(encode_segment, video_file_path, start_time, end_time, output_filepath, stream_copy): (start_time, end_time, output_filepath)
+            for start_time, end_time, output_filepath in jobs
+        }
+        for future in as_completed(futures):
+            start_time, end_time, output_filepath = futures[future]
+            try:
+                future.result()
+                # 片段时长在分割时已知，登记后合并等后续步骤无需再调用 ffprobe；重新编码时流布局未知，只登记时长
+                media_probe.record(output_filepath, end_time - start_time, source_info.streams if stream_copy else None)
+                print(f"视频片段 [{start_time:.2f}s - {end_time:.2f}s] 已保存到: {output_filepath}")
+            except FileNotFoundError:
+                print(f"错误：找不到 'ffmpeg' 命令。请确保已安装并在 PATH 中。")
+                for pending in futures:
+                    pending.cancel()
+                return None # 停止处理
+            except subprocess.CalledProcessError as e:
+                print(f"错误：ffmpeg 分割视频片段 [{start_time:.2f}s - {end_time:.2f}s] 失败。")
+                print(f"命令: {' '.join(e.cmd)}")
+                print(f"错误信息: {e.stderr.decode()}")
+                print("警告：该片段分割失败，其余片段继续切割，本次分段将记为失败。")
+                failed.append(output_filepath)
+
+    if failed:
+        # 缺少片段时不写出时间戳文件，避免阶段缓存把不完整的分段记为已完成
+        print(f"错误：{len(failed)} 个视频片段分割失败: {failed}")
         return None
 
-    # --- 处理视频尾部 ---
-    # 只有在最后一个找到的时间戳 < 视频总长时才需要处理尾部
-    if start_time < video_duration :
-        print(f"处理最后一个视频片段: [{start_time:.2f}s - {video_duration:.2f}s]")
-        output_filename = f"segment_{segment_index}.mp4"
-        output_filepath = os.path.join(output_dir, output_filename)
-
-        command = [
-            'ffmpeg', '-y', # Overwrite output files without asking
-            '-i', video_file_path,
-            '-ss', str(start_time),
-            '-to', str(video_duration),
-            '-vf', 'scale=-2:360',
-            '-r', '1',
-            '-c:v', 'libx264',
-            '-crf','28',
-            '-c:a', 'libopus',
-            '-ac','1',
-            '-b:a', '1k',
-            output_filepath
-        ]
-        try:
-            # print(f"执行命令: {' '.join(command)}") # Optional debug print
-            subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            print(f"最后一个视频片段已保存到: {output_filepath}")
-            # 不需要在这里加 segment_timestamps.append(video_duration)
-            # 因为后面的逻辑会自动添加
-        except FileNotFoundError:
-            print(f"错误：找不到 'ffmpeg' 命令。")
-            # 即使尾部失败，我们仍然有之前的时间戳，可能可以继续处理 gap 文件
-        except subprocess.CalledProcessError as e:
-            print(f"错误：ffmpeg 分割最后一个片段失败。")
-            print(f"命令: {' '.join(command)}")
-            print(f"错误信息: {e.stderr.decode()}")
-            # 同上，可能继续处理 gap 文件
-
-    # --- 最终确定时间戳列表 ---
-    # 确保最后一个时间戳是视频总时长
-    segment_timestamps.append(video_duration)
-
     print(f"视频分割处理完成。最终分割时间点 (秒): {segment_timestamps}")
     with open(os.path.join(output_dir, "divide_timastamps.txt"), 'w') as file:
         for item in segment_timestamps:
@@ -191,55 +256,34 @@ def split_video_by_thresholds(vad_file_path, video_file_path, output_dir, thresh
 
 
 
-def split_gap_csv(segment_timestamps, gap_file_path, output_dir):
+def split_gaps(segment_timestamps, gaps, min_duration=0.0):
     """
-    遍历gap_file_path的第一列（已按顺序排列），将处于segment_timestamps
-    中相邻两个时间戳（含前不含后的区间）的若干行分离出一个新的csv文件,
-    这些行的每个时间戳都减去区间左端点，将输出到 output_dir文件夹中，
-    文件名segment_1.csv、segment_2.csv等。
+    把对白间隙按 segment_timestamps 中相邻两个时间戳分开，每段的起始时间减去区间左端点。
+    流复制时分割点是静音中的关键帧，可能落在某个间隙中间：这样的间隙被裁剪到片段边界，
+    拆成前后两段各一行，片段内的间隙不会超出片段末尾。
 
     Args:
         segment_timestamps (list): 有序的时间戳列表，用于分割数据。
-        gap_file_path (str): 输入的包含按顺序排列的时间戳的CSV文件路径
-                             （第一列为时间戳）。
-        output_dir (str): 输出CSV文件的目录。
+        gaps (timeline.Timeline): 全片的对白间隙。
+        min_duration (float): 裁剪后时长不超过该值（秒）的间隙被丢弃。
+
+    Returns:
+        list: 每个片段一个 timeline.Timeline，顺序与 segment_1、segment_2 ... 一致。
+    """
+    return gaps.split(intervals.SegmentTimeline(segment_timestamps), clip=True, min_duration=min_duration)
+
+def split_gap_csv(segment_timestamps, gap_file_path, output_dir):
+    """
+    split_gaps 的文件版本：读取 gap_file_path（起始, 时长，无表头），
+    输出到 output_dir 文件夹中，文件名segment_1.csv、segment_2.csv等。
     """
     os.makedirs(output_dir, exist_ok=True)
-    segment_count = 1
-
-    with open(gap_file_path, 'r', newline='') as infile:
-        reader = csv.reader(infile)
-
-        data_buffer = []
-        for row in reader:
-            if row:
-                try:
-                    #timestamp = float(row[0])
-                    data_buffer.append([float(row[0]),float(row[1])])
-                except ValueError:
-                    print(f"警告: 在文件 {gap_file_path} 中发现无法转换为浮点数的时间戳: {row[0]}")
-
-        data_index = 0
-        for i in range(len(segment_timestamps) - 1):
-            start_time = segment_timestamps[i]
-            end_time = segment_timestamps[i+1]
-
-            output_file_path = os.path.join(output_dir, f'segment_{segment_count}.csv')
-            segment_count += 1
-
-            with open(output_file_path, 'w', newline='') as outfile:
-                writer = csv.writer(outfile)
-
-                while data_index < len(data_buffer):
-                    timestamp=data_buffer[data_index][0]
-                    duration=data_buffer[data_index][1]
-                    if start_time-0.00001 <= timestamp < end_time-0.00001:
-                        processed_row = [round(timestamp-start_time , 1) ,duration]
-                        writer.writerow(processed_row)
-                        data_index += 1
-                    else:
-                        break  # 由于输入文件已排序，超出当前区间即可停止内部循环
-                    
+
+    gaps = timeline.Timeline.from_csv(gap_file_path, columns=timeline.GAP_COLUMNS, header=False)
+    for segment_count, part in enumerate(split_gaps(segment_timestamps, gaps), start=1):
+        output_file_path = os.path.join(output_dir, f'segment_{segment_count}.csv')
+        part.to_csv(output_file_path, columns=timeline.GAP_COLUMNS, header=False, decimals=None)
+
 
 
 # --- 主程序部分 ---
@@ -258,7 +302,7 @@ if __name__ == "__main__":
     # 假设 split_video_by_thresholds 函数已经更新或存在，并返回时间戳列表
     # from previous_script import split_video_by_thresholds # 或者直接包含在这里
     segment_timestamps = split_video_by_thresholds(
-        vad_csv_file,
+        timeline.Timeline.from_spans(intervals.read_span_csv(vad_csv_file)),
         video_file,
         video_output_folder,
         time_threshold_step
@@ -1,22 +1,30 @@
 import argparse  # 用于处理命令行参数
-import csv
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import google.generativeai as genai
 
+import keyframe_sampling
 import simplify_sentence_ad
+import timeline
 
 # --- 常量定义 ---
 MODEL_NAME = 'gemini-2.0-flash-001'#gemini-2.5-pro-preview-03-25和gemini-2.0-flash-thinking-exp-01-21由于配额和限速原因不好用
-OUTPUT_CSV_HEADER = ["start_time","duration", "description"]
 # Gemini API 文件上传/处理的轮询间隔（秒）
 FILE_PROCESSING_POLL_INTERVAL = 10
 # Gemini API 文件上传/处理的超时时间（秒）
 FILE_PROCESSING_TIMEOUT = 300 # 5 分钟
 MAX_UPLOAD_ATTEMPTS = 3      # 最大上传尝试次数 (1次初始尝试 + 2次重试)
 RETRY_DELAY = 10             # 每次重试前的等待时间（秒）
+# MODEL_NAME 的请求配额（每分钟请求数），gemini-2.0-flash 免费层为 15 RPM
+MODEL_REQUESTS_PER_MINUTE = 15
+# 为 True 时向 Gemini 发送按镜头采样的关键帧图片，而不是上传整个视频，减少上传量和 token
+USE_KEYFRAMES = True
+# 同时处理的视频片段数（上传、轮询和对话并发进行）
+MAX_CONCURRENT_SEGMENTS = 4
 PROMPT_TEMPLATE = """任务：理解视频内容，生成文本描述。
 
 输入信息：
@@ -38,6 +46,31 @@ PROMPT_TEMPLATE = """任务：理解视频内容，生成文本描述。
 
 
 # --- 函数定义 ---
+class TokenBucket:
+    """线程安全的令牌桶限速器，acquire() 在没有令牌时阻塞等待。"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0 # 每秒补充的令牌数
+        self.capacity = capacity if capacity is not None else max(1, rate_per_minute // 4)
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+# 所有片段共享的模型请求限速器
+model_rate_limiter = TokenBucket(MODEL_REQUESTS_PER_MINUTE)
+
 def format_seconds_rounded(seconds):
   """使用数学运算将以秒为单位的时间四舍五入并格式化为 MM:SS 格式。"""
   rounded_seconds = round(seconds)
@@ -52,41 +85,20 @@ def time_to_seconds(time_str):
     return total_seconds
   except ValueError:
     return "输入格式错误，请使用 MM:SS 格式"
-def write_csv(filepath, data, header):
-    """将数据写入 CSV 文件。"""
-    try:
-        with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(header)
-            for row in data:
-                writer.writerow(row)
-        print(f"成功将结果写入 CSV 文件: {filepath}")
-    except IOError as e:
-        print(f"写入 CSV 文件时发生 IO 错误 {filepath}: {e}")
-    except Exception as e:
-        print(f"写入 CSV 文件时发生未知错误 {filepath}: {e}")
+def format_gap_data(gaps):
+    """将对白间隙（timeline.Timeline）格式化为插入到 Prompt 中的字符串。"""
+    res = ""
+    for start_seconds, duration in zip(gaps.start.tolist(), gaps.duration.tolist()):
+        start = format_seconds_rounded(start_seconds)#改成MM:SS的形式
+        end = format_seconds_rounded(start_seconds+duration)
+        chars=int(duration*5)
+        res=res+"\n"+str(start)+","+str(end)+","+str(chars)
+    return res
 
 def read_gap_file(filepath):
-    """读取并解析对白间隙信息文件。"""
-    res = ""
+    """读取并解析对白间隙信息文件（起始, 时长，无表头）。"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for i, row in enumerate(reader):
-                # 跳过空行或格式不正确的行
-                if not row or len(row) != 2:
-                    print(f"警告: 跳过间隙文件第 {i+1} 行，格式不正确: {row}")
-                    continue
-                try:
-                    start = format_seconds_rounded(float(row[0].strip()))#改成MM:SS的形式
-                    end = format_seconds_rounded(float(row[0].strip())+float(row[1].strip()))
-                    chars=int(float(row[1].strip())*5)
-                    res=res+"\n"+str(start)+","+str(end)+","+str(chars)
-                except ValueError:
-                    print(f"警告: 跳过间隙文件第 {i+1} 行，无法解析为数字: {row}")
-                    continue
-        """将间隙数据格式化为插入到 Prompt 中的字符串。"""
-        return res
+        return timeline.Timeline.from_csv(filepath, columns=timeline.GAP_COLUMNS, header=False)
     except FileNotFoundError:
         print(f"错误: 找不到间隙文件 {filepath}")
         return None
@@ -201,6 +213,22 @@ def upload_file_with_retry(filepath):
     return None
 
 
+def build_keyframe_parts(video_path):
+    """把视频片段的关键帧整理成消息内容：每张 JPEG 前附上其在片段中的时间 (MM:SS)。失败时返回 None。"""
+    try:
+        keyframes = keyframe_sampling.extract_keyframes(video_path)
+    except Exception as e:
+        print(f"警告: 关键帧采样失败，将改为上传整个视频: {e}")
+        return None
+    if not keyframes:
+        return None
+    parts = ["以下是该视频片段按镜头采样的关键帧，每张图片前标注了它在片段中的时间 (MM:SS)。"]
+    for timestamp, data in keyframes:
+        parts.append(format_seconds_rounded(timestamp))
+        parts.append({"mime_type": "image/jpeg", "data": data})
+    return parts
+
+
 def generate_descriptions(api_key, video_path, gap_data_string):
     """配置 API，上传文件，调用 Gemini 模型生成描述。"""
     try:
@@ -211,11 +239,14 @@ def generate_descriptions(api_key, video_path, gap_data_string):
 
     uploaded_video = None
     try:
-        # 1. 上传视频文件
-        uploaded_video = upload_file_with_retry(video_path)
-        if not uploaded_video:
-            print("视频文件上传或处理失败，无法继续。")
-            return None # 上传失败，直接返回
+        # 1. 准备视频内容：优先发送关键帧图片（无需上传和轮询），不可用时上传视频文件
+        media_parts = build_keyframe_parts(video_path) if USE_KEYFRAMES else None
+        if not media_parts:
+            uploaded_video = upload_file_with_retry(video_path)
+            if not uploaded_video:
+                print("视频文件上传或处理失败，无法继续。")
+                return None # 上传失败，直接返回
+            media_parts = [uploaded_video]
 
         # 2.--- 初始化 Gemini 模型和聊天 ---
         print(f"初始化 Gemini 模型: {MODEL_NAME}")
@@ -236,7 +267,8 @@ def generate_descriptions(api_key, video_path, gap_data_string):
         print("开始与 Gemini 进行聊天会话...")
 
         chat = model.start_chat(history=[])
-        response=chat.send_message([uploaded_video, "这个视频片段中的主要人物已用绿色文字标注角色名称，请给出这段视频中出现的主要人物。"])
+        model_rate_limiter.acquire()
+        response=chat.send_message(media_parts + ["这个视频片段中的主要人物已用绿色文字标注角色名称，请给出这段视频中出现的主要人物。"])
         print(response.text)
 
         # 3. 准备 Prompt
@@ -251,6 +283,7 @@ def generate_descriptions(api_key, video_path, gap_data_string):
 
         
         # 4. 调用模型生成内容
+        model_rate_limiter.acquire()
         response = chat.send_message(full_prompt)
 
         # 5. 处理响应
@@ -313,14 +346,21 @@ def generate_descriptions(api_key, video_path, gap_data_string):
                 print(f"警告: 删除上传的视频文件时发生错误: {e}")
 
 # --- 主程序入口 ---
-def gen_AD_script(video_path,gap_path,output_path):
+def describe_segment(video_path,gaps):
+    """
+    为一个视频片段生成 AD 脚本。
+
+    Args:
+        video_path (str): 视频片段路径。
+        gaps (timeline.Timeline): 片段内的对白间隙（时间相对片段起点）。
+
+    Returns:
+        timeline.Timeline or None: 每条描述的起始时间、时长和文本；失败时返回 None。
+    """
     # --- 检查输入文件是否存在 ---
     if not os.path.isfile(video_path):
         print(f"错误: 视频文件不存在 {video_path}")
         exit(1)
-    if not os.path.isfile(gap_path):
-        print(f"错误: 间隙信息文件不存在 {gap_path}")
-        exit(1)
 
     # --- 获取 API Key ---
     api_key = os.getenv("GEMINI_API_KEY")
@@ -329,12 +369,8 @@ def gen_AD_script(video_path,gap_path,output_path):
         exit(1)
     print("成功获取 GEMINI_API_KEY。")
 
-    # --- 读取间隙数据 ---
-    print(f"正在读取间隙文件: {gap_path}")
-    gap_data_string = read_gap_file(gap_path)
-    if gap_data_string is None:
-        print("无法读取间隙文件，程序终止。")
-        exit(1)
+    # --- 间隙数据 ---
+    gap_data_string = format_gap_data(gaps)
     if not gap_data_string:
         print("警告: 间隙文件为空或未包含有效数据，程序终止。")
         #exit(0) # 文件有效但无内容，正常退出
@@ -344,11 +380,11 @@ def gen_AD_script(video_path,gap_path,output_path):
 
     if descriptions is None:
         print("未能从 Gemini 获取有效的描述。请检查错误信息。程序终止。")
-        return
+        return None
 
     print(f"Gemini 返回了 {len(descriptions)} 个描述。")
 
-    # --- 写入 CSV 文件 ---
+    # --- 整理为时间轴 ---
     # 简化部分
     print("descriptions未简化前：\n")
     print(descriptions)
@@ -364,7 +400,7 @@ def gen_AD_script(video_path,gap_path,output_path):
         else:
             print(f"警告：跳过格式不正确的行: {item_string}")
 
-    filtered_descriptions=[]
+    timed_descriptions=[] # (下标, 起始秒, 时长)
     # 现在使用处理后的列表
     for i in range(len(processed_descriptions)):
         try:
@@ -372,15 +408,7 @@ def gen_AD_script(video_path,gap_path,output_path):
             end_time = time_to_seconds(processed_descriptions[i][1])   # processed_descriptions[i][1] 是 '04:07' 这样的字符串
             duration = end_time - start_time
             if duration <=0: continue # 避免负数时长
-            simplified_desc = simplify_sentence_ad.shorten_sentence(processed_descriptions[i][2], int(duration * 5))
-            processed_descriptions[i][0]=start_time
-            processed_descriptions[i][1]=duration
-            processed_descriptions[i][2] = simplified_desc # 更新处理后的列表中的描述部分
-            if i==0:
-                filtered_descriptions.append(processed_descriptions[i])
-            else:
-                if simplified_desc!=processed_descriptions[i-1][2]:
-                    filtered_descriptions.append(processed_descriptions[i])
+            timed_descriptions.append((i, start_time, duration))
 
         except ValueError as e:
             print(f"错误：在处理第 {i} 项时无法转换时间戳 '{processed_descriptions[i][0]}' 或 '{processed_descriptions[i][1]}' 为数字: {e}. 跳过此项。")
@@ -388,16 +416,95 @@ def gen_AD_script(video_path,gap_path,output_path):
         except IndexError:
             print(f"错误：在处理第 {i} 项时索引超出范围。数据：{processed_descriptions[i]}. 跳过此项。")
             continue
+
+    # 本片段的所有描述一次性简化，子句嵌入批量计算
+    simplified_descs = simplify_sentence_ad.shorten_sentences(
+        [(processed_descriptions[i][2], int(duration * 5)) for i, _, duration in timed_descriptions]
+    )
+    filtered_descriptions=[]
+    for (i, start_time, duration), simplified_desc in zip(timed_descriptions, simplified_descs):
+        processed_descriptions[i][0]=start_time
+        processed_descriptions[i][1]=duration
+        processed_descriptions[i][2] = simplified_desc # 更新处理后的列表中的描述部分
+        if i==0:
+            filtered_descriptions.append(processed_descriptions[i])
+        else:
+            if simplified_desc!=processed_descriptions[i-1][2]:
+                filtered_descriptions.append(processed_descriptions[i])
     print("descriptions简化之后：\n")
     print(filtered_descriptions)
     # 简化完成
 
-    if filtered_descriptions:
-        write_csv(str(output_path), filtered_descriptions, OUTPUT_CSV_HEADER)
-    else:
+    if not filtered_descriptions:
         print("没有成功匹配的描述和间隙数据可写入文件。")
+        return None
 
     print("处理完成。")
+    starts, durations, texts = zip(*filtered_descriptions)
+    return timeline.Timeline(starts, durations, texts)
+
+def gen_AD_script(video_path,gap_path,output_path):
+    """describe_segment 的文件版本：从 gap_path 读取间隙，把 AD 脚本写入 output_path（CSV）。"""
+    if not os.path.isfile(gap_path):
+        print(f"错误: 间隙信息文件不存在 {gap_path}")
+        exit(1)
+
+    # --- 读取间隙数据 ---
+    print(f"正在读取间隙文件: {gap_path}")
+    gaps = read_gap_file(gap_path)
+    if gaps is None:
+        print("无法读取间隙文件，程序终止。")
+        exit(1)
+
+    script = describe_segment(video_path, gaps)
+    if script is None:
+        return False
+    try:
+        script.to_csv(str(output_path), columns=timeline.AD_SCRIPT_COLUMNS[:3])
+        print(f"成功将结果写入 CSV 文件: {output_path}")
+    except IOError as e:
+        print(f"写入 CSV 文件时发生 IO 错误 {output_path}: {e}")
+        return False
+    return True
+
+def gen_AD_scripts(jobs, max_workers=MAX_CONCURRENT_SEGMENTS, runner=None):
+    """
+    并发为多个视频片段生成 AD 脚本。网络等待（上传、状态轮询、对话）在各片段之间重叠，
+    模型请求由 model_rate_limiter 统一限速，不会超出 MODEL_NAME 的配额。
+
+    Args:
+        jobs (list): 每个片段传给 runner 的参数元组，第一个元素为视频片段路径，
+                     默认 runner 下为 [(video_path, gap_path, output_path), ...]。
+        max_workers (int): 同时处理的片段数上限。
+        runner (callable): 处理单个片段的函数，返回 None 或 False 表示失败，默认为 gen_AD_script。
+
+    Returns:
+        list: 与 jobs 顺序一致的 runner 返回值，失败的片段为 None。
+    """
+    if runner is None:
+        runner = gen_AD_script
+    results = [None] * len(jobs)
+    if not jobs:
+        return results
+    print(f"并发生成 {len(jobs)} 个片段的 AD 脚本 (并发数: {max_workers}, 限速: {MODEL_REQUESTS_PER_MINUTE} RPM)")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(runner, *job): index
+            for index, job in enumerate(jobs)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            video_path = jobs[index][0]
+            try:
+                result = future.result()
+                if result is None or result is False:
+                    print(f"片段 {Path(video_path).name} 未能生成 AD 脚本。")
+                else:
+                    results[index] = result
+                    print(f"片段 {Path(video_path).name} 的 AD 脚本生成完成。")
+            except Exception as e:
+                print(f"片段 {Path(video_path).name} 生成 AD 脚本时发生错误: {e}")
+    return results
 
 if __name__=="__main__":
     gen_AD_script(r"D:\Thunder\BloodyBattleTaierzhuang_0419test\BloodyBattleInTaierzhuang_1fps_30min.mp4",
@@ -0,0 +1,177 @@
+import csv
+
+import numpy as np
+
+# 对白间隙：起始时间与时长（秒）
+GAP_DTYPE = np.dtype([('start', 'f8'), ('duration', 'f8')])
+
+
+def as_spans(rows):
+    """把 [[起始, 结束], ...] 转换为按起始时间排序的 (N, 2) float64 数组。"""
+    spans = np.asarray(rows, dtype=np.float64).reshape(-1, 2)
+    if len(spans) > 1 and np.any(np.diff(spans[:, 0]) < 0):
+        spans = spans[np.argsort(spans[:, 0], kind='stable')]
+    return spans
+
+def read_span_csv(path, skip_header=False):
+    """
+    读取前两列为数字的 CSV，返回 (N, 2) float64 数组；无法解析的行会被跳过。
+    可用于 _vad.csv（起始, 结束）、_gap.csv（起始, 时长）和 AD 脚本（起始, 时长, ...）。
+    """
+    rows = []
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        if skip_header:
+            next(reader, None)
+        for row in reader:
+            if len(row) < 2:
+                continue
+            try:
+                rows.append((float(row[0]), float(row[1])))
+            except ValueError:
+                continue
+    return np.asarray(rows, dtype=np.float64).reshape(-1, 2)
+
+def merge_spans(spans, max_join=0.0):
+    """合并相互重叠或间隔不超过 max_join 秒的语音段。"""
+    spans = as_spans(spans)
+    if len(spans) == 0:
+        return spans
+    # 到当前位置为止的最大结束时间，避免被包含的短段打断合并
+    running_end = np.maximum.accumulate(spans[:, 1])
+    new_group = np.empty(len(spans), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = spans[1:, 0] - running_end[:-1] > max_join
+    starts = spans[new_group, 0]
+    ends = np.maximum.reduceat(spans[:, 1], np.flatnonzero(new_group))
+    return np.column_stack([starts, ends])
+
+def compute_gaps(spans, min_gap=2.0, origin=0.0, end_time=None, pad=0.0, lookahead=0.0, max_join=0.0, decimals=1):
+    """
+    由语音段计算对白间隙。
+
+    Args:
+        spans: 语音段 [[起始, 结束], ...]。
+        min_gap (float): 间隙需严格长于该值（秒）才保留。
+        origin (float): 时间轴起点，第一段语音之前的静音从这里算起。
+        end_time (float): 给出时，最后一段语音之后到 end_time 的静音也作为间隙。
+        pad (float): 语音结束后保留的余量，间隙起点后移这么多。
+        lookahead (float): 下一段语音开始前预留的余量，间隙终点前移这么多。
+        max_join (float): 先合并间隔不超过该值的语音段。
+        decimals (int): 结果保留的小数位数，None 表示不取整。
+
+    Returns:
+        np.ndarray: GAP_DTYPE 结构化数组 (start, duration)。
+    """
+    spans = merge_spans(spans, max_join) if max_join > 0 else as_spans(spans)
+    gap_starts = np.concatenate([[origin], spans[:, 1]])
+    if end_time is None:
+        gap_starts = gap_starts[:-1]
+        gap_ends = spans[:, 0]
+    else:
+        gap_ends = np.concatenate([spans[:, 0], [end_time]])
+    gap_starts = gap_starts + pad * (np.arange(len(gap_starts)) > 0) # 时间轴起点处没有前一段语音
+    gap_ends = gap_ends - lookahead
+    durations = gap_ends - gap_starts
+    if decimals is not None:
+        gap_starts = np.round(gap_starts, decimals)
+        durations = np.round(durations, decimals)
+    keep = durations > min_gap
+
+    gaps = np.empty(int(keep.sum()), dtype=GAP_DTYPE)
+    gaps['start'] = gap_starts[keep]
+    gaps['duration'] = durations[keep]
+    return gaps
+
+def iter_gaps(spans, min_gap=2.0, origin=0.0, pad=0.0, lookahead=0.0, max_join=0.0, decimals=1):
+    """
+    compute_gaps（不含 end_time）的流式版本：spans 按起始时间依次给出（如 VAD 的流式输出），
+    下一段语音一开始，它之前的间隙就立即产出，不必等全片检测完。参数含义与 compute_gaps 相同。
+
+    Yields:
+        tuple: (起始, 时长)。
+    """
+    running_end = None
+    for start, end in spans:
+        if running_end is None:
+            gap_start = origin # 时间轴起点处没有前一段语音，不加 pad
+        elif start - running_end > max_join:
+            gap_start = running_end + pad
+        else:
+            # 与前一段语音合并，没有间隙
+            running_end = max(running_end, end)
+            continue
+        running_end = end if running_end is None else max(running_end, end)
+        duration = start - lookahead - gap_start
+        if decimals is not None:
+            gap_start = round(gap_start, decimals)
+            duration = round(duration, decimals)
+        if duration > min_gap:
+            yield gap_start, duration
+
+def edge_windows(starts, durations, before=10.0, after=1.0, shrink=1.0, end_time=None, decimals=1):
+    """
+    为每个区间生成开头和结尾两侧的上下文窗口，交替排列：
+    [起始-before, 起始+after]，[结束-shrink, 结束-shrink+before+after]，窗口被裁剪到 [0, end_time]。
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = starts + np.asarray(durations, dtype=np.float64) - shrink
+    upper = np.inf if end_time is None else end_time
+    windows = np.empty((len(starts) * 2, 2), dtype=np.float64)
+    windows[0::2, 0] = np.maximum(0, starts - before)
+    windows[0::2, 1] = starts + after
+    windows[1::2, 0] = ends
+    windows[1::2, 1] = np.minimum(upper, ends + before + after)
+    if decimals is not None:
+        windows = np.round(windows, decimals)
+    return windows
+
+# 比较时间戳时的容差，与分段时的 -0.00001 保持一致
+TIME_EPSILON = 1e-5
+
+def starting_in(starts, t0, t1):
+    """起始时间落在 [t0, t1) 内的行的切片（starts 升序），O(log n)。"""
+    lo, hi = np.searchsorted(starts, [t0 - TIME_EPSILON, t1 - TIME_EPSILON], side='left')
+    return slice(int(lo), int(hi))
+
+def overlapping(starts, ends, t0, t1):
+    """
+    与 [t0, t1) 有交集的行的切片，O(log n)。要求各行按起始时间排序且互不重叠
+    （如 VAD 语音段、对白间隙），此时结束时间同样有序，可以二分查找。
+    """
+    lo = np.searchsorted(ends, t0 + TIME_EPSILON, side='right')
+    hi = np.searchsorted(starts, t1 - TIME_EPSILON, side='left')
+    return slice(int(lo), int(max(lo, hi)))
+
+class SegmentTimeline:
+    """
+    视频分段的边界 [0, t1, t2, ..., 总时长]。分段（全局时间 -> 片段内时间）和
+    合并（片段内时间 -> 全局时间）都通过它完成，两者使用同一组边界，不会错位。
+    """
+
+    def __init__(self, boundaries):
+        self.boundaries = np.asarray(boundaries, dtype=np.float64)
+
+    @classmethod
+    def from_file(cls, path):
+        """读取 divide_video 写出的 divide_timastamps.txt（每行一个时间戳）。"""
+        with open(path, 'r') as f:
+            return cls([float(line) for line in f if line.strip()])
+
+    def __len__(self):
+        return max(0, len(self.boundaries) - 1)
+
+    def bounds(self, segment_number):
+        """片段（编号从 1 开始）的全片时间范围 (起点, 终点)。"""
+        return float(self.boundaries[segment_number - 1]), float(self.boundaries[segment_number])
+
+    def to_local(self, segment_number, global_times, decimals=1):
+        """全片时间转换为片段内时间（片段编号从 1 开始）。"""
+        local_times = np.asarray(global_times, dtype=np.float64) - self.boundaries[segment_number - 1]
+        if decimals is not None:
+            local_times = np.round(local_times, decimals) + 0.0 # 去掉 -0.0
+        return local_times
+
+    def to_global(self, segment_number, local_times):
+        """片段内时间（片段编号从 1 开始）转换为全片时间。"""
+        return np.asarray(local_times, dtype=np.float64) + self.boundaries[segment_number - 1]
@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+
+# --- 配置 ---
+SCENE_CUT_THRESHOLD = 0.6   # 相邻帧直方图相关系数低于该值视为镜头切换（character_recognition 也据此立即重新检测人脸）
+CONTENT_CHANGE_THRESHOLD = 0.85 # 与上一张关键帧的相关系数低于该值时，镜头内画面变化较大，也保留一帧
+MIN_KEYFRAME_GAP = 1.0      # 两张关键帧之间的最小间隔（秒），镜头切换不受此限制
+MAX_KEYFRAME_GAP = 8.0      # 静态镜头中至少每隔这么久保留一帧（秒）
+MAX_KEYFRAMES = 150         # 每个片段最多保留的关键帧数，超过时均匀抽稀
+JPEG_QUALITY = 80
+
+
+def frame_histogram(frame):
+    """计算帧的 HSV 色调-饱和度直方图，用于镜头切换检测。"""
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    cv2.normalize(hist, hist)
+    return hist
+
+def histogram_similarity(hist_a, hist_b):
+    return cv2.compareHist(hist_a, hist_b, cv2.HISTCMP_CORREL)
+
+def extract_keyframes(video_path):
+    """
+    解码视频，按镜头选出有代表性的关键帧：每个镜头的第一帧、镜头内画面明显变化的帧，
+    以及静态镜头中每隔 MAX_KEYFRAME_GAP 秒的一帧。静态画面少取帧，动作场面多取帧。
+
+    Returns:
+        list or None: [(时间戳秒, JPEG 字节), ...]，视频无法读取时返回 None。
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"错误: 无法打开视频文件 {video_path}")
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if fps <= 0:
+        fps = 1.0
+
+    keyframes = []
+    previous_hist = None
+    last_selected_hist = None
+    last_selected_time = None
+    frame_index = 0
+    shots = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            timestamp = frame_index / fps
+            frame_index += 1
+            hist = frame_histogram(frame)
+
+            scene_cut = previous_hist is None or histogram_similarity(previous_hist, hist) < SCENE_CUT_THRESHOLD
+            previous_hist = hist
+            if scene_cut:
+                shots += 1
+                select = True
+            else:
+                since_last = timestamp - last_selected_time
+                changed = histogram_similarity(last_selected_hist, hist) < CONTENT_CHANGE_THRESHOLD
+                select = since_last >= MAX_KEYFRAME_GAP or (changed and since_last >= MIN_KEYFRAME_GAP)
+            if not select:
+                continue
+
+            ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if ok:
+                keyframes.append((timestamp, encoded.tobytes()))
+                last_selected_hist = hist
+                last_selected_time = timestamp
+    finally:
+        cap.release()
+
+    if len(keyframes) > MAX_KEYFRAMES:
+        keep = np.linspace(0, len(keyframes) - 1, MAX_KEYFRAMES).round().astype(int)
+        keyframes = [keyframes[i] for i in np.unique(keep)]
+
+    total_bytes = sum(len(data) for _, data in keyframes)
+    print(f"关键帧采样: {frame_index} 帧 -> {len(keyframes)} 张关键帧 ({shots} 个镜头, {total_bytes / 1024:.0f} KB)")
+    return keyframes
@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import threading
+
+# 进程内的探测结果缓存：绝对路径 -> ((大小, mtime), MediaInfo)，文件被改写后自动失效
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+
+class MediaInfo:
+    """ffprobe 得到的媒体信息：总时长（秒）和各条流的布局。"""
+
+    def __init__(self, duration, streams=None):
+        self.duration = duration
+        # [{'index', 'codec_type', 'codec_name', 'sample_rate', 'channels', 'width', 'height'}, ...]；
+        # 为 None 表示只登记了时长、流布局未知
+        self.streams = None if streams is None else list(streams)
+
+    def first_stream(self, codec_type):
+        for stream in self.streams or ():
+            if stream.get('codec_type') == codec_type:
+                return stream
+        return None
+
+    @property
+    def has_video(self):
+        return self.first_stream('video') is not None
+
+    @property
+    def has_audio(self):
+        return self.first_stream('audio') is not None
+
+    @property
+    def sample_rate(self):
+        """第一条音频流的采样率，没有音频流时为 None。"""
+        audio = self.first_stream('audio')
+        return int(audio['sample_rate']) if audio and audio.get('sample_rate') else None
+
+    @property
+    def channels(self):
+        audio = self.first_stream('audio')
+        return int(audio['channels']) if audio and audio.get('channels') else None
+
+
+def _cache_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), (stat.st_size, stat.st_mtime_ns)
+
+def run_ffprobe(path):
+    """调用一次 ffprobe，同时取得时长和流布局。失败时打印错误并返回 None。"""
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration:stream=index,codec_type,codec_name,sample_rate,channels,width,height',
+        '-of', 'json',
+        path
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True, encoding='utf-8')
+        metadata = json.loads(result.stdout)
+        return MediaInfo(float(metadata['format']['duration']), metadata.get('streams', []))
+    except FileNotFoundError:
+        print(f"错误：找不到 'ffprobe' 命令。请确保 ffmpeg 已安装并在系统 PATH 中。")
+    except subprocess.CalledProcessError as e:
+        print(f"错误：ffprobe 探测 '{path}' 失败。")
+        print(f"错误信息: {e.stderr}")
+    except (ValueError, KeyError) as e:
+        print(f"错误：无法解析 ffprobe 对 '{path}' 的输出: {e}")
+    return None
+
+def probe(path):
+    """
+    获取媒体文件的 MediaInfo。结果按 (路径, 大小, mtime) 缓存，
+    同一文件在整个流程中只调用一次 ffprobe。只登记了时长（流布局未知）的文件仍会调用 ffprobe。
+
+    Returns:
+        MediaInfo or None: 文件不存在或探测失败时返回 None。
+    """
+    try:
+        abs_path, signature = _cache_key(path)
+    except OSError:
+        print(f"错误：媒体文件不存在: {path}")
+        return None
+    with _probe_lock:
+        cached = _probe_cache.get(abs_path)
+    if cached and cached[0] == signature and cached[1].streams is not None:
+        return cached[1]
+
+    info = run_ffprobe(path)
+    if info is not None:
+        with _probe_lock:
+            _probe_cache[abs_path] = (signature, info)
+    return info
+
+def get_duration(path):
+    """媒体时长（秒），失败时返回 None。已登记时长的文件不调用 ffprobe。"""
+    try:
+        abs_path, signature = _cache_key(path)
+    except OSError:
+        print(f"错误：媒体文件不存在: {path}")
+        return None
+    with _probe_lock:
+        cached = _probe_cache.get(abs_path)
+    if cached and cached[0] == signature:
+        return cached[1].duration
+    info = probe(path)
+    return info.duration if info else None
+
+def record(path, duration, streams=None):
+    """
+    登记刚写出的文件的信息（如分段时已知的片段时长），之后的 get_duration 不再调用 ffprobe。
+    streams 为 None 时流布局未知，probe 仍会调用 ffprobe 获取完整信息。
+    文件再被改写时登记自动失效。
+    """
+    abs_path, signature = _cache_key(path)
+    info = MediaInfo(float(duration), streams)
+    with _probe_lock:
+        _probe_cache[abs_path] = (signature, info)
+    return info
@@ -1,22 +1,32 @@
-import json
 import os
-import subprocess
 
+import numpy as np
 import pandas as pd
 
+import intervals
+import media_probe
+import timeline
 
-def get_video_duration(video_path):
-    """Get video duration in seconds using ffprobe."""
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'json',
-        video_path
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-    metadata = json.loads(result.stdout)
-    return float(metadata['format']['duration'])
+
+def merge_AD_scripts(scripts, segment_timeline):
+    """
+    把各片段的 AD 脚本合并为全片脚本。
+
+    Args:
+        scripts (list): 按片段顺序排列的 timeline.Timeline，时间相对片段起点；没有脚本的片段为 None。
+        segment_timeline (intervals.SegmentTimeline): 分段时使用的边界。
+
+    Returns:
+        timeline.Timeline: 全片时间的 AD 脚本，起始时间保留一位小数。
+    """
+    parts = []
+    for segment_num, script in enumerate(scripts, start=1):
+        if script is None:
+            continue
+        part = script.take(slice(None))
+        part.start = np.round(segment_timeline.to_global(segment_num, script.start), 1)
+        parts.append(part)
+    return timeline.Timeline.concat(parts)
 
 def merge_AD_script(video_seg_dir):
     # 获取所有AD_script.csv文件并按编号排序
@@ -31,30 +41,36 @@ def merge_AD_script(video_seg_dir):
     else:
         raise FileNotFoundError("No _AD_script.csv files found in video_seg directory")
     
+    # 优先使用分段时记录的边界，与 split_gap_csv 使用同一条时间轴
+    timestamps_path = os.path.join(video_seg_dir, "divide_timastamps.txt")
+    segment_timeline = intervals.SegmentTimeline.from_file(timestamps_path) if os.path.exists(timestamps_path) else None
+
     total_duration = 0.0
     all_data = []
 
     for csv_file in csv_files:
-        # 获取对应的视频文件路径
+        # 片段编号
         segment_num = csv_file.split('_')[1]
-        video_file = f'segment_{segment_num}.mp4'
-        video_path = os.path.join(video_seg_dir, video_file)
-
-        # 获取视频时长
-        duration = get_video_duration(video_path)
 
         # 读取CSV文件
         csv_path = os.path.join(video_seg_dir, csv_file)
         df = pd.read_csv(csv_path)
 
-        # 前两列加上之前视频的总时长
-        df.iloc[:, 0] = df.iloc[:, 0] + total_duration
+        # 第一列从片段内时间换算为全片时间
+        if segment_timeline is not None:
+            df.iloc[:, 0] = segment_timeline.to_global(int(segment_num), df.iloc[:, 0])
+        else:
+            df.iloc[:, 0] = df.iloc[:, 0] + total_duration
+            video_path = os.path.join(video_seg_dir, f'segment_{segment_num}.mp4')
+            segment_duration = media_probe.get_duration(video_path) # 分段时已登记时长，不会重新调用 ffprobe
+            if segment_duration is None:
+                raise FileNotFoundError(f"无法获取片段时长: {video_path}")
+            total_duration += segment_duration
 
         # 保留一位小数
         df = df.round(1)
 
         all_data.append(df)
-        total_duration += duration
 
     # 合并所有数据并保存
     output_path=os.path.join(video_seg_dir, 'merged_AD_scripts.csv')
@@ -1,28 +1,156 @@
+import os
 import re
-from collections import deque
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 
-import jieba
-import jieba.posseg as pseg
 import numpy as np
-import torch  # sentence-transformers 通常需要 torch 或 tensorflow
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 
+# torch、sentence_transformers、onnxruntime 和 jieba 都在第一次真正需要缩短描述时才导入，
+# 没有超长描述时不承担这些库的启动开销
 model_name='shibing624/text2vec-base-chinese'
+# 句向量后端："sentence_transformers"（PyTorch）或 "onnx"（ONNX Runtime CPU）
+EMBEDDING_BACKEND = "sentence_transformers"
+ONNX_MODEL_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'text2vec_onnx') # 导出的 ONNX 模型存放位置，每个模型一个子目录
+ONNX_QUANTIZE_INT8 = True # ONNX 后端是否使用 int8 动态量化的模型
+ONNX_MAX_LENGTH = 128 # 子句的最大 token 数
+# 导出（或量化）的模型与 SentenceTransformer 输出的最小余弦相似度，达不到时删除该模型并报错
+ONNX_MIN_COSINE = 0.999
+ONNX_INT8_MIN_COSINE = 0.97
+ONNX_VALIDATION_TEXTS = ("画面中一名士兵跑过战壕，", "远处传来爆炸声。", "她转身看向窗外，神情凝重。", "镜头缓缓推向城门")
+
+
+class SentenceTransformerBackend:
+    """PyTorch SentenceTransformer 后端，有 GPU 时使用 GPU。"""
+
+    def __init__(self, name=model_name):
+        import torch  # sentence-transformers 通常需要 torch 或 tensorflow
+        from sentence_transformers import SentenceTransformer
+
+        # 尝试自动选择设备 (GPU if available, else CPU)
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model = SentenceTransformer(name, device=device)
+        print(f"Using device: {device}")
+
+    def encode(self, texts, batch_size=64):
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+
+def onnx_model_dir(name, root=ONNX_MODEL_DIR):
+    """每个模型导出到单独的子目录，换模型时不会误用旧的导出。"""
+    return os.path.join(root, name.replace('/', '--'))
+
+def onnx_encode(session, tokenizer, texts, batch_size=64):
+    """用 ONNX Runtime 会话编码，平均池化（只计入非填充的 token）。"""
+    input_names = {model_input.name for model_input in session.get_inputs()}
+    vectors = []
+    for begin in range(0, len(texts), batch_size):
+        tokens = tokenizer(texts[begin:begin + batch_size], padding=True, truncation=True, max_length=ONNX_MAX_LENGTH, return_tensors='np')
+        feeds = {key: value.astype(np.int64) for key, value in tokens.items() if key in input_names}
+        hidden = session.run(None, feeds)[0]
+        mask = tokens['attention_mask'][..., None].astype(np.float32)
+        vectors.append((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9))
+    return np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+
+class OnnxEmbeddingBackend:
+    """
+    text2vec 编码器的 ONNX Runtime CPU 后端，输出与 SentenceTransformer 相同（平均池化）。
+    首次使用时用 transformers 导出 ONNX 模型（并可做 int8 动态量化），与 SentenceTransformer 的输出核对一致后才采用，
+    之后直接加载，推理不需要 torch。
+    """
+
+    def __init__(self, name=model_name, model_dir=None, quantize=ONNX_QUANTIZE_INT8):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_dir = model_dir or onnx_model_dir(name)
+        model_path = self.prepare_model(name, model_dir, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        print(f"Using ONNX Runtime (CPU): {model_path}")
+
+    @staticmethod
+    def prepare_model(name, model_dir, quantize):
+        """返回 ONNX 模型路径，不存在时导出并核对（只在第一次运行时需要 torch）。"""
+        fp32_path = os.path.join(model_dir, 'model.onnx')
+        int8_path = os.path.join(model_dir, 'model_int8.onnx')
+        reference = []
+        def reference_vectors():
+            if not reference:
+                reference.append(SentenceTransformerBackend(name).encode(list(ONNX_VALIDATION_TEXTS)))
+            return reference[0]
+
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            print(f"Exporting {name} to ONNX: {fp32_path}")
+            os.makedirs(model_dir, exist_ok=True)
+            tokenizer = AutoTokenizer.from_pretrained(name)
+            model = AutoModel.from_pretrained(name).eval()
+            dummy = tokenizer(["导出"], return_tensors='pt')
+            # 导出器按 forward 的参数顺序（input_ids, attention_mask, token_type_ids）排列图的输入，
+            # 以位置参数传入并按同样顺序命名，推理时按名字送入的张量才能对上
+            input_names = [key for key in ('input_ids', 'attention_mask', 'token_type_ids') if key in dummy]
+            dynamic_axes = {key: {0: 'batch', 1: 'sequence'} for key in input_names}
+            dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+            with torch.no_grad():
+                torch.onnx.export(
+                    model, tuple(dummy[key] for key in input_names), fp32_path,
+                    input_names=input_names, output_names=['last_hidden_state'],
+                    dynamic_axes=dynamic_axes, opset_version=14,
+                )
+            tokenizer.save_pretrained(model_dir)
+            OnnxEmbeddingBackend.validate(fp32_path, model_dir, reference_vectors(), ONNX_MIN_COSINE)
+        if not quantize:
+            return fp32_path
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+            OnnxEmbeddingBackend.validate(int8_path, model_dir, reference_vectors(), ONNX_INT8_MIN_COSINE)
+        return int8_path
+
+    @staticmethod
+    def validate(model_path, model_dir, reference, min_cosine):
+        """把 ONNX_VALIDATION_TEXTS 的输出与 SentenceTransformer 比较，不一致时删除该模型并抛出 RuntimeError。"""
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        vectors = onnx_encode(session, AutoTokenizer.from_pretrained(model_dir), list(ONNX_VALIDATION_TEXTS))
+        reference = np.asarray(reference, dtype=np.float32)
+        cosine = (vectors * reference).sum(axis=1) / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference, axis=1), 1e-12)
+        del session
+        if cosine.min() < min_cosine:
+            os.remove(model_path)
+            raise RuntimeError(f"ONNX 模型 {model_path} 与 SentenceTransformer 输出不一致（最小余弦相似度 {cosine.min():.4f} < {min_cosine}），已删除")
+        print(f"ONNX 模型核对通过（最小余弦相似度 {cosine.min():.4f}）: {model_path}")
+
+    def encode(self, texts, batch_size=64):
+        return onnx_encode(self.session, self.tokenizer, texts, batch_size)
+
+
+EMBEDDING_BACKENDS = {
+    "sentence_transformers": SentenceTransformerBackend,
+    "onnx": OnnxEmbeddingBackend,
+}
+
 sentence_model=None
+sentence_model_lock=threading.Lock()
 def get_global_model():
+    """按 EMBEDDING_BACKEND 加载句向量后端（只加载一次），加载失败时返回 None。"""
     global sentence_model
-    if sentence_model is None:
-        try:            
-            print("\nInitializing sentence model...\n")
-            # 尝试自动选择设备 (GPU if available, else CPU)
-            device = 'cuda' if torch.cuda.is_available() else 'cpu'
-            sentence_model = SentenceTransformer(model_name, device=device)
-            print(f"Using device: {device}")
-        except Exception as e:
-            print(f"Error loading Sentence Transformer sentence_model '{model_name}': {e}")
-            print("Falling back to basic truncation.")
-            sentence_model=None# 如果模型加载失败，可以回退到之前的 safe_truncate 或简单截断
+    with sentence_model_lock:
+        if sentence_model is None:
+            try:
+                print("\nInitializing sentence model...\n")
+                sentence_model = EMBEDDING_BACKENDS[EMBEDDING_BACKEND](model_name)
+            except Exception as e:
+                print(f"Error loading {EMBEDDING_BACKEND} sentence_model '{model_name}': {e}")
+                print("Falling back to basic truncation.")
+                sentence_model=None# 如果模型加载失败，可以回退到之前的 safe_truncate 或简单截断
     return sentence_model
     
 
@@ -50,146 +178,227 @@ def split_clauses_v2(text):
     return clauses 
 
 
-# --- Advanced NLP Shortening Function ---
+# --- 子句嵌入缓存 ---
+CLAUSE_CACHE_SIZE = 4096 # 缓存的子句嵌入数
+ENCODE_BATCH_SIZE = 64
 
-def shorten_sentence(text, max_len):
+class ClauseEmbeddingCache:
+    """
+    子句嵌入的 LRU 缓存。同一部影片的描述中经常出现相同的子句（重复生成的描述、
+    相邻片段的相同场景），已编码的子句直接复用；未命中的子句合并成一次批量编码。
     """
-    使用句子嵌入进行抽取式摘要来缩短句子。
 
-    Args:
-        text (str): 输入文本。
-        max_len (int): 最大目标长度。
+    def __init__(self, capacity=CLAUSE_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
 
-    Returns:
-        str: 缩短后的文本。
-    """
-    # 0. 预处理和长度检查
-    text = re.sub(r'\s+', '', text).strip()
-    text = re.sub(r'[a-zA-Z0-9]+', '', text).strip()#出去字母和数字，因为tts无法正常读取字母和数字。
-    text = text.replace("字", "")
-    
+    def encode(self, sentence_model, clauses):
+        """返回 (len(clauses), d) 的单位化嵌入矩阵，行顺序与 clauses 一致。"""
+        with self.lock:
+            missing = []
+            for clause in clauses:
+                if clause in self.entries:
+                    self.entries.move_to_end(clause)
+                elif clause not in missing:
+                    missing.append(clause)
+            self.hits += len(clauses) - len(missing)
+            self.misses += len(missing)
+            if missing:
+                vectors = sentence_model.encode(missing, batch_size=ENCODE_BATCH_SIZE)
+                vectors = np.asarray(vectors, dtype=np.float32)
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = vectors / np.maximum(norms, 1e-12)
+                for clause, vector in zip(missing, vectors):
+                    self.entries[clause] = vector
+            # 先取出本次需要的全部向量，再按容量淘汰最久未用的子句
+            matrix = np.stack([self.entries[clause] for clause in clauses]) if clauses else np.empty((0, 0), dtype=np.float32)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        return matrix
+
+clause_cache = ClauseEmbeddingCache()
+
+
+# --- Advanced NLP Shortening Function ---
+chinese_punctuation = r'[，。、？！；‘’“”【】（）《》]'
+chinese_period = "。"
+
+def end_with_period(text):
+    """把末尾的中文标点换成句号，没有标点时补一个句号。"""
     last_char = text[-1]
-    chinese_punctuation = r'[，。、？！；‘’“”【】（）《》]'
-    chinese_period = "。"
     if re.match(chinese_punctuation, last_char):
         if last_char != chinese_period:
-            text= text[:-1] + chinese_period
+            text = text[:-1] + chinese_period
     else:
-        text=text + chinese_period
-    # 使用正则表达式匹配中文字符
-    chinese_characters = re.findall(r'[\u4e00-\u9fa5]', text)
-    if len(chinese_characters) <= max_len:
+        text = text + chinese_period
+    return text
+
+def normalize_description(text):
+    """去除空白、字母和数字（tts无法正常读取），并以句号结尾。"""
+    text = re.sub(r'\s+', '', text).strip()
+    text = re.sub(r'[a-zA-Z0-9]+', '', text).strip()#出去字母和数字，因为tts无法正常读取字母和数字。
+    text = text.replace("字", "")
+    if not text:
         return text
+    return end_with_period(text)
 
-    # 1. 加载模型 (如果需要多次调用，建议在外部加载模型)
+def chinese_length(text):
+    """中文字符数。"""
+    return len(re.findall(r'[\u4e00-\u9fa5]', text))
+
+def knapsack_select(lengths, values, capacity):
+    """
+    0/1 背包：在总长度不超过 capacity 的前提下使 values 之和最大，返回选中的下标（升序）。
+    子句数和 max_len 都很小，按容量向量化的动态规划开销可以忽略。
+    """
+    capacity = max(0, int(capacity))
+    best = np.zeros(capacity + 1)
+    taken = np.zeros((len(lengths), capacity + 1), dtype=bool)
+    for i, (length, value) in enumerate(zip(lengths, values)):
+        if length > capacity:
+            continue
+        candidate = best[:capacity + 1 - length] + value # 容量 c 处取 best[c-length] + value
+        improve = candidate > best[length:]
+        taken[i, length:] = improve
+        best[length:] = np.where(improve, candidate, best[length:])
+    selected = []
+    remaining = capacity
+    for i in range(len(lengths) - 1, -1, -1):
+        if taken[i, remaining]:
+            selected.append(i)
+            remaining -= lengths[i]
+    return selected[::-1]
+
+def select_clauses(clauses, lengths, embeddings, max_len):
+    """
+    以子句与所有子句平均嵌入的余弦相似度为重要性，用 0/1 背包选出总字数不超过 max_len
+    且总相似度最大的子句，按原始顺序拼接。
+
+    Args:
+        clauses (list): 子句。
+        lengths (list): 每个子句的中文字符数（预先计算一次）。
+        embeddings (np.ndarray): 单位化后的子句嵌入矩阵。
+        max_len (int): 字数上限。
+    """
+    # 中心嵌入 (所有子句嵌入的平均值)，相似度即单位向量的点积
+    centroid = embeddings.mean(axis=0)
+    centroid = centroid / max(np.linalg.norm(centroid), 1e-12)
+    scores = embeddings @ centroid
+
+    # 每个子句至少有一点价值；总分相同时字数多者优先，尽量用满字数
+    values = np.maximum(scores, 1e-3) + 1e-4 * np.asarray(lengths)
+    selected = knapsack_select(lengths, values, max_len)
+    return "".join(clauses[index] for index in selected)
+
+def shorten_sentences(items):
+    """
+    批量缩短描述。先找出所有超长且能分句的描述，把它们的子句一次性批量编码
+    （命中 clause_cache 的子句不再编码），再逐条选择子句。
+
+    Args:
+        items (list): [(text, max_len), ...]，一部影片或一个片段的全部描述。
+
+    Returns:
+        list: 与 items 顺序一致的缩短后的文本。
+    """
+    results = [None] * len(items)
+    pending = [] # (下标, 文本, 子句, max_len)
+    for index, (text, max_len) in enumerate(items):
+        # 0. 预处理和长度检查
+        text = normalize_description(text)
+        if not text or chinese_length(text) <= max_len:
+            results[index] = text
+            continue
+        # 1. 分割成子句；无法有效分割时直接截断
+        clauses = split_clauses_v2(text)
+        if len(clauses) <= 1:
+            results[index] = safe_truncate_v2(text, max_len)
+            continue
+        pending.append((index, text, clauses, max_len))
+    if not pending:
+        return results
+
+    # 2. 加载模型
     sentence_model=get_global_model()
     if sentence_model is None:
-        return safe_truncate_v2(text, max_len) # 复用之前的安全截断
-    
-    # 2. 分割成子句
-    clauses = split_clauses_v2(text)
-    if not clauses:
-        # 如果无法分割，直接截断
-        return safe_truncate_v2(text, max_len)
-    if len(clauses) == 1:
-         # 如果只有一个子句（无法有效分割），也直接截断
-         return safe_truncate_v2(text, max_len)
-
-    # 3. 计算子句嵌入
-    # 使用 show_progress_bar=True 可以看到编码进度
-    embeddings = sentence_model.encode(clauses, convert_to_numpy=True, show_progress_bar=False)
-
-    # 4. 计算句子（或文本段落）的中心嵌入 (所有子句嵌入的平均值)
-    centroid_embedding = np.mean(embeddings, axis=0)
-
-    # 5. 计算每个子句与中心嵌入的相似度 (作为重要性分数)
-    similarities = cosine_similarity(embeddings, centroid_embedding.reshape(1, -1))
-    # similarities 是一个 N x 1 的矩阵，将其展平成一维数组
-    scores = similarities.flatten()
-
-    # 6. 选择最重要的子句，直到达到长度限制
-    selected_indices = []
-    current_length = 0
-    # 按原始顺序存储选中的子句，方便最后组合
-    result_clauses_map = {}
-
-    # 将分数和原始索引配对，按分数从高到低排序
-    indexed_scores = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
-
-    # 优先选择分数高的子句，但要保证不超过长度，并尽量保持原顺序
-    selected_indices_set = set() # 记录已选择的索引，避免重复计算长度
-    temp_result_clauses = [None] * len(clauses) # 按原顺序占位
-
-    for index, score in indexed_scores:
-        clause_text = clauses[index]
-        clause_len = len(re.findall(r'[\u4e00-\u9fa5]', clause_text))#只计算中文字符的长度
-
-        # 检查加入这个子句是否会超长
-        if current_length + clause_len <= max_len:
-            # 只有当这个索引还没被最终选定时才加入
-            if index not in selected_indices_set:
-                 temp_result_clauses[index] = clause_text # 放入正确的位置
-                 current_length += clause_len
-                 selected_indices_set.add(index)
-
-    # 7. 按原始顺序组合选出的子句
-    final_clauses = [clause for clause in temp_result_clauses if clause is not None]
-    shortened_text = "".join(final_clauses)
-
-    # 8. 后处理和返回
-    # 如果结果为空或太短，可能需要回退策略
-    if not shortened_text or len(shortened_text) < 0.3 * max_len: # 设置一个最小长度阈值，例如30%
-        # print("Embedding selection result too short, falling back to truncation.")
-        # 回退到安全截断可能更稳妥
-        return safe_truncate_v2(text, max_len)
-
-    # 如果缩短后的文本末尾不是结束性标点，且原文本有，可以尝试添加一个
-    # (这个逻辑比较复杂，暂时省略，避免引入错误)
-
-    last_char_=shortened_text[-1]
-    if re.match(chinese_punctuation, last_char_):
-        if last_char_ != chinese_period:
-            shortened_text= shortened_text[:-1] + chinese_period
-    else:
-        shortened_text=shortened_text + chinese_period
-    return shortened_text.strip()
+        for index, text, _, max_len in pending:
+            results[index] = safe_truncate_v2(text, max_len) # 复用之前的安全截断
+        return results
+
+    # 3. 所有待缩短描述的子句一次批量编码
+    all_clauses = [clause for _, _, clauses, _ in pending for clause in clauses]
+    embeddings = clause_cache.encode(sentence_model, all_clauses)
+
+    # 4. 逐条选择子句
+    offset = 0
+    for index, text, clauses, max_len in pending:
+        lengths = [chinese_length(clause) for clause in clauses]
+        shortened_text = select_clauses(clauses, lengths, embeddings[offset:offset + len(clauses)], max_len)
+        offset += len(clauses)
+        # 如果结果为空或太短，回退到安全截断
+        if not shortened_text or len(shortened_text) < 0.3 * max_len: # 设置一个最小长度阈值，例如30%
+            results[index] = safe_truncate_v2(text, max_len)
+        else:
+            results[index] = end_with_period(shortened_text).strip()
+    return results
+
+def shorten_sentence(text, max_len):
+    """
+    使用句子嵌入进行抽取式摘要来缩短句子。需要缩短多条描述时使用 shorten_sentences。
+
+    Args:
+        text (str): 输入文本。
+        max_len (int): 最大目标长度。
+
+    Returns:
+        str: 缩短后的文本。
+    """
+    return shorten_sentences([(text, max_len)])[0]
 
 
 # --- 复用之前的 safe_truncate_v2 ---
+def chinese_prefix_counts(text):
+    """前缀和：counts[k] 为 text[:k] 中的中文字符数，长度为 len(text)+1。"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+    is_chinese = (codes >= 0x4e00) & (codes <= 0x9fa5)
+    return np.concatenate([[0], np.cumsum(is_chinese)])
+
+@lru_cache(maxsize=256)
+def word_boundaries(text):
+    """对全文做一次 jieba 分词，返回各词边界的字符下标（含 0 和 len(text)）。"""
+    import jieba
+
+    words = jieba.cut(text, cut_all=False)
+    return np.concatenate([[0], np.cumsum([len(word) for word in words])]).astype(np.int64)
+
 def safe_truncate_v2(text, max_len):
-    """三重保障安全截断 V2 (逻辑类似，可微调)"""
+    """三重保障安全截断 V2 (逻辑类似，可微调)。前缀和定位截断点，整体为线性时间。"""
     search_end = max(0, max_len - 10)
-    prefix=""
-    for i in range(len(text)-1, search_end -1, -1):
-        if len(re.findall(r'[\u4e00-\u9fa5]', text[:i+1])) <= max_len:
-            prefix=text[:i+1]
-            break
+    # 中文字数不超过 max_len 的最长前缀；前缀和单调不减，二分查找即可
+    cut = int(np.searchsorted(chinese_prefix_counts(text), max_len, side='right')) - 1
+    prefix = text[:cut] if cut >= search_end + 1 else ""
 
     # 优先在 max_len 附近寻找完整句子结束标点
     sentence_end_chars = '。！？!?…'
-    best_cut = -1
-    for i in range(len(prefix)-1, search_end -1, -1):
-        if  text[i] in sentence_end_chars: # 边界检查
-            best_cut = i + 1
-            break
+    best_cut = max(prefix.rfind(char, search_end) for char in sentence_end_chars)
     if best_cut != -1:
-        return text[:best_cut]
+        return text[:best_cut + 1]
 
     # 第二层：在 max_len 附近寻找常用分隔标点
     split_chars = '，；,;'
-    best_split_cut = -1
-    for i in range(len(prefix) - 1, search_end -1, -1):
-         if text[i] in split_chars: # 边界检查
-            best_split_cut = i + 1 # 保留该标点
-            break
+    best_split_cut = max(prefix.rfind(char, search_end) for char in split_chars)
     if best_split_cut != -1:
-       return text[:best_split_cut-1]+"。"
+       return text[:best_split_cut]+"。"
 
-    # 第三层：尝试在词语边界截断 (在 max_len 内)
+    # 第三层：尝试在词语边界截断 (在 max_len 内)，去掉前缀末尾的最后一个词
     try:
-        words = list(jieba.cut(prefix, cut_all=False))
-        if len(words) > 1:
-            truncated_by_word = ''.join(words[:-1])#-1 是切片的结束索引。在列表（或字符串）中，负数索引表示从末尾开始计数，-1 代表最后一个元素，-2 代表倒数第二个元素，以此类推。结束索引不包含该索引对应的元素。
+        boundaries = word_boundaries(text)
+        last_boundary = int(boundaries[np.searchsorted(boundaries, len(prefix), side='left') - 1]) if len(prefix) else 0
+        if last_boundary > 0:
+            truncated_by_word = prefix[:last_boundary]
             if len(truncated_by_word) >= max_len * 0.8:
                  # 简单返回去掉最后一个词的结果
                  return truncated_by_word.strip()+"。" # 去掉末尾可能多余的空格
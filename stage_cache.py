@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import threading
+
+# 改变缓存键的计算方式时递增，使旧的清单全部失效
+CACHE_VERSION = 1
+MANIFEST_NAME = "stage_manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class StageCache:
+    """
+    以内容寻址的流水线阶段缓存。
+
+    每个阶段的键由阶段名、输入文件内容的哈希和参数共同计算，结果记录在
+    certain_path 下的清单文件中。重新运行时，键未变化且输出仍然存在的阶段会被跳过，
+    流水线从第一个过期的阶段继续执行。上游阶段的输出是下游阶段的输入，
+    因此上游重新生成了不同的内容时，下游会自动失效。
+    """
+
+    def __init__(self, certain_path, manifest_name=MANIFEST_NAME):
+        self.manifest_path = os.path.join(certain_path, manifest_name)
+        self.lock = threading.Lock()
+        self.manifest = {"version": CACHE_VERSION, "fingerprints": {}, "stages": {}}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == CACHE_VERSION:
+                    self.manifest = manifest
+                else:
+                    print(f"阶段缓存清单版本不匹配，将重新执行所有阶段: {self.manifest_path}")
+            except (OSError, ValueError) as e:
+                print(f"警告: 读取阶段缓存清单失败，将重新执行所有阶段: {e}")
+
+    def file_fingerprint(self, path):
+        """
+        计算文件内容的 sha256。结果按 (路径, 大小, mtime) 记在清单里，
+        文件未改动时不会重复读取整部影片。
+        """
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        with self.lock:
+            cached = self.manifest["fingerprints"].get(abs_path)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            return cached["sha256"]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self.lock:
+            self.manifest["fingerprints"][abs_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest,
+            }
+        return digest
+
+    def path_fingerprint(self, path):
+        """文件返回内容哈希；目录返回其中所有文件（按相对路径排序）的组合哈希；不存在时返回 None。"""
+        if os.path.isfile(path):
+            return self.file_fingerprint(path)
+        if os.path.isdir(path):
+            sha = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    sha.update(os.path.relpath(file_path, path).encode('utf-8'))
+                    sha.update(self.file_fingerprint(file_path).encode('ascii'))
+            return sha.hexdigest()
+        return None
+
+    def stage_key(self, stage, inputs, params=None):
+        """由阶段名、输入内容和参数计算阶段缓存键。"""
+        payload = {
+            "stage": stage,
+            "inputs": [self.path_fingerprint(path) for path in inputs],
+            "params": params or {},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def is_fresh(self, stage, inputs, outputs, params=None):
+        """阶段的键与清单一致且所有输出都存在时返回 True。"""
+        with self.lock:
+            entry = self.manifest["stages"].get(stage)
+        if entry is None:
+            return False
+        if not all(os.path.exists(path) for path in outputs):
+            return False
+        return entry["key"] == self.stage_key(stage, inputs, params)
+
+    def cached_result(self, stage):
+        with self.lock:
+            entry = self.manifest["stages"].get(stage)
+        return entry.get("result") if entry else None
+
+    def record(self, stage, inputs, outputs, params=None, result=None):
+        """记录阶段已完成，并立即写回清单，保证崩溃后已完成的阶段不会丢失。"""
+        key = self.stage_key(stage, inputs, params)
+        with self.lock:
+            self.manifest["stages"][stage] = {
+                "key": key,
+                "outputs": [os.path.abspath(path) for path in outputs],
+                "result": result,
+            }
+        self.save()
+
+    def invalidate(self, stage):
+        with self.lock:
+            self.manifest["stages"].pop(stage, None)
+        self.save()
+
+    def save(self):
+        with self.lock:
+            temp_path = self.manifest_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.manifest_path)
+
+    def run_stage(self, stage, func, inputs, outputs, params=None):
+        """
+        执行一个阶段，阶段未过期时直接返回上次的结果。
+
+        Args:
+            stage (str): 阶段名，在清单中唯一。
+            func (callable): 无参数的阶段函数，返回值需可 JSON 序列化；返回 False 或输出不完整视为失败。
+            inputs (list): 输入文件或目录路径。
+            outputs (list): 输出文件或目录路径。
+            params (dict): 影响输出的参数。
+
+        Returns:
+            阶段函数的返回值（或缓存的返回值）。
+        """
+        if self.is_fresh(stage, inputs, outputs, params):
+            print(f"[缓存] 阶段 '{stage}' 未变化，跳过。")
+            return self.cached_result(stage)
+
+        print(f"[缓存] 执行阶段 '{stage}'...")
+        result = func()
+        if result is False:
+            print(f"[缓存] 阶段 '{stage}' 未成功完成，不记录缓存。")
+            self.invalidate(stage)
+            return result
+        if not all(os.path.exists(path) for path in outputs):
+            print(f"[缓存] 阶段 '{stage}' 的输出不完整，不记录缓存。")
+            self.invalidate(stage)
+            return result
+        self.record(stage, inputs, outputs, params, result)
+        return result
+
+    def run_checkpoint_stage(self, stage, func, inputs, checkpoint_path, load, params=None):
+        """
+        执行一个产出内存对象（如 timeline.Timeline）的阶段。对象保存为 checkpoint_path 检查点；
+        阶段未过期时不执行 func，直接用 load(checkpoint_path) 读取检查点。
+
+        Args:
+            func (callable): 无参数的阶段函数，返回带 save(path) 方法的对象，返回 None 视为失败。
+            load (callable): 从检查点读取对象的函数。
+
+        Returns:
+            阶段产出的对象，失败时返回 None。
+        """
+        produced = []
+        def run():
+            value = func()
+            if value is None:
+                return False
+            value.save(checkpoint_path)
+            produced.append(value)
+
+        if self.run_stage(stage, run, inputs, [checkpoint_path], params) is False:
+            return None
+        if produced:
+            return produced[0]
+        return load(checkpoint_path)
@@ -0,0 +1,189 @@
+import csv
+import hashlib
+
+import numpy as np
+
+import intervals
+
+FIELDS = ('start', 'duration', 'text', 'emotion', 'speaker')
+# merged_AD_scripts.csv 的列（界面编辑和 tts_with_emo 读取的格式）
+AD_SCRIPT_COLUMNS = (('start_time', 'start'), ('duration', 'duration'), ('description', 'text'), ('Sense', 'emotion'))
+# 无表头的对白间隙 CSV（起始, 时长）
+GAP_COLUMNS = (('start', 'start'), ('duration', 'duration'))
+
+
+class Timeline:
+    """
+    流水线各阶段之间传递的时间轴：一组按起始时间排序的区间，
+    每个区间有起始时间、时长（秒）、文本、情感和说话人。
+    VAD 语音段、对白间隙、AD 脚本都用它表示，检查点保存为单个压缩 .npz 文件。
+    """
+
+    def __init__(self, start=(), duration=(), text=None, emotion=None, speaker=None):
+        self.start = np.asarray(start, dtype=np.float64).reshape(-1)
+        self.duration = np.asarray(duration, dtype=np.float64).reshape(-1)
+        if len(self.start) != len(self.duration):
+            raise ValueError("start 与 duration 的长度不一致")
+        count = len(self.start)
+        self.text = self._strings(text, count)
+        self.emotion = self._strings(emotion, count)
+        self.speaker = self._strings(speaker, count)
+
+    @staticmethod
+    def _strings(values, count):
+        array = np.empty(count, dtype=object)
+        array[:] = [''] * count if values is None else [str(v) for v in values]
+        return array
+
+    # --- 构造 ---
+    @classmethod
+    def from_spans(cls, spans, **columns):
+        """由 [[起始, 结束], ...] 构造。"""
+        spans = intervals.as_spans(spans)
+        return cls(spans[:, 0], spans[:, 1] - spans[:, 0], **columns)
+
+    @classmethod
+    def from_gaps(cls, gaps):
+        """由 intervals.GAP_DTYPE 数组构造。"""
+        return cls(gaps['start'], gaps['duration'])
+
+    @classmethod
+    def concat(cls, timelines):
+        timelines = list(timelines)
+        if not timelines:
+            return cls()
+        return cls(
+            np.concatenate([t.start for t in timelines]),
+            np.concatenate([t.duration for t in timelines]),
+            np.concatenate([t.text for t in timelines]),
+            np.concatenate([t.emotion for t in timelines]),
+            np.concatenate([t.speaker for t in timelines]),
+        )
+
+    # --- 访问 ---
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+    def spans(self):
+        """(N, 2) 的 [起始, 结束] 数组。"""
+        return np.column_stack([self.start, self.end])
+
+    def take(self, index):
+        """按切片、下标数组或布尔掩码取出子时间轴。"""
+        return Timeline(self.start[index], self.duration[index], self.text[index], self.emotion[index], self.speaker[index])
+
+    # --- 区间查询（要求按起始时间排序）---
+    def starting_in(self, t0, t1):
+        """起始时间落在 [t0, t1) 内的子时间轴。"""
+        return self.take(intervals.starting_in(self.start, t0, t1))
+
+    def overlapping(self, t0, t1):
+        """与 [t0, t1) 有交集的子时间轴，要求各区间互不重叠（如 VAD 语音段、对白间隙）。"""
+        return self.take(intervals.overlapping(self.start, self.end, t0, t1))
+
+    def split(self, segment_timeline, decimals=1, clip=False, min_duration=0.0):
+        """
+        按 intervals.SegmentTimeline 的边界切分，每段的起始时间改为相对片段起点。
+
+        clip 为 False 时按起始时间归属（含前不含后），适用于 AD 脚本等以起点定位的条目；
+        clip 为 True 时取与片段有交集的区间并裁剪到片段边界内，跨越分割点的区间（如关键帧分割点
+        落在静音中间时的对白间隙）拆成两行分属前后两段，裁剪后时长不超过 min_duration 的行被丢弃。
+        """
+        parts = []
+        for number in range(1, len(segment_timeline) + 1):
+            t0, t1 = segment_timeline.bounds(number)
+            if not clip:
+                part = self.starting_in(t0, t1)
+                part.start = segment_timeline.to_local(number, part.start, decimals)
+                parts.append(part)
+                continue
+            part = self.overlapping(t0, t1)
+            end = np.minimum(part.end, t1)
+            part.start = np.maximum(part.start, t0)
+            part.duration = end - part.start
+            if decimals is not None:
+                part.duration = np.round(part.duration, decimals)
+            part = part.take(part.duration > min_duration)
+            part.start = segment_timeline.to_local(number, part.start, decimals)
+            parts.append(part)
+        return parts
+
+    def fingerprint(self):
+        """内容哈希，用作阶段缓存的参数。"""
+        sha = hashlib.sha256()
+        sha.update(self.start.tobytes())
+        sha.update(self.duration.tobytes())
+        for field in ('text', 'emotion', 'speaker'):
+            sha.update('\x1f'.join(getattr(self, field)).encode('utf-8'))
+        return sha.hexdigest()
+
+    # --- 检查点 ---
+    def save(self, path):
+        """保存为压缩 .npz（字符串列以定长 unicode 存储，不使用 pickle）。"""
+        with open(path, 'wb') as f: # 传入文件对象，避免 numpy 自动追加 .npz 后缀
+            np.savez_compressed(
+                f,
+                start=self.start,
+                duration=self.duration,
+                text=self.text.astype(str),
+                emotion=self.emotion.astype(str),
+                speaker=self.speaker.astype(str),
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(*(data[field] for field in FIELDS))
+
+    # --- CSV（供界面编辑和独立运行各模块时使用）---
+    def to_csv(self, path, columns=AD_SCRIPT_COLUMNS, header=True, decimals=1):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow([name for name, _ in columns])
+            values = []
+            for _, field in columns:
+                column = getattr(self, field)
+                if field in ('start', 'duration') and decimals is not None:
+                    column = np.round(column, decimals)
+                values.append(column.tolist())
+            writer.writerows(zip(*values))
+
+    @classmethod
+    def from_csv(cls, path, columns=AD_SCRIPT_COLUMNS, header=True):
+        """按 columns 指定的字段顺序读取 CSV；缺少的列为空。"""
+        fields = {field: [] for _, field in columns}
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            if header:
+                next(reader, None)
+            for row in reader:
+                if len(row) < 2:
+                    continue
+                try:
+                    start, duration = float(row[0]), float(row[1])
+                except ValueError:
+                    continue
+                fields['start'].append(start)
+                fields['duration'].append(duration)
+                for position, (_, field) in enumerate(columns[2:], start=2):
+                    fields[field].append(row[position] if position < len(row) else '')
+        return cls(**fields)
+
+
+if __name__ == '__main__':
+    # 自检：关键帧分割点落在静音中间时，跨越分割点的对白间隙拆到前后两段，不会越过片段末尾
+    segments = intervals.SegmentTimeline([0.0, 600.0, 1200.0])
+    gaps = Timeline([100.0, 595.0, 1190.0], [10.0, 12.0, 3.0])
+    first, second = gaps.split(segments, clip=True, min_duration=2)
+    assert first.start.tolist() == [100.0, 595.0] and first.duration.tolist() == [10.0, 5.0], (first.start, first.duration)
+    assert second.start.tolist() == [0.0, 590.0] and second.duration.tolist() == [7.0, 3.0], (second.start, second.duration)
+    assert all((part.end <= length + intervals.TIME_EPSILON).all() for part, length in zip((first, second), np.diff(segments.boundaries)))
+    # 不裁剪时按起始时间归属
+    first, second = gaps.split(segments)
+    assert first.start.tolist() == [100.0, 595.0] and second.start.tolist() == [590.0]
+    print("timeline 自检通过")
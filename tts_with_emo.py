@@ -2,7 +2,10 @@ import glob  # 用于文件清理
 import os
 import re  # 用于正则表达式
 import subprocess  # 用于调用FFmpeg
+import threading
 import tkinter as tk
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from tkinter import messagebox, ttk
 
@@ -10,132 +13,222 @@ import torch
 import numpy as np
 import pandas as pd
 from pydub import AudioSegment
-from pydub.utils import mediainfo
 # 初始化支持中文TTS模型
 from TTS.api import TTS
 
-# Get device
-device = "cuda" if torch.cuda.is_available() else "cpu"
-# Init TTS
-tts = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
-
+import media_probe
+
+TTS_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+TTS_LANGUAGE = "zh"
+# 合成工作者数：有 GPU 时为线程数（每个线程一份模型和一个 CUDA stream），否则为进程数（每个进程一份模型）
+TTS_WORKERS = 2
+TTS_GROUP_SIZE = 16 # 同一情感参考音频的台词每多少行作为一个任务，参考音频的条件潜变量每个任务只计算一次
+EMOTION_WAV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emotion_wav")
+# 情感 -> 参考音频；未知情感默认使用中性风格
+EMOTION_REFERENCES = {
+    "HAPPY": "happy_6.wav",
+    "SAD": "sad_6.wav",
+    "NEUTRAL": "neutral_6.wav",
+    "ANGRY": "angry_6.wav",
+    "SURPRISED": "surprised_6.wav",
+}
+
+
+def emotion_reference(emotion):
+    """选择情感对应的参考音频文件。"""
+    return os.path.join(EMOTION_WAV_DIR, EMOTION_REFERENCES.get(emotion, "neutral_6.wav"))
+
+def load_tts(device):
+    return TTS(TTS_MODEL_NAME).to(device)
+
+def synthesize_group(model, style_wav, texts):
+    """
+    用同一参考音频合成多行台词：参考音频的条件潜变量只计算一次，之后逐行直接调用 XTTS 推理。
+
+    Returns:
+        tuple: (采样率, [float32 波形, ...])。
+    """
+    xtts = model.synthesizer.tts_model
+    config = xtts.config
+    # 与 tts_to_file（Xtts.synthesize）使用相同的参考音频处理和采样参数
+    gpt_cond_latent, speaker_embedding = xtts.get_conditioning_latents(
+        audio_path=[style_wav],
+        gpt_cond_len=config.gpt_cond_len,
+        gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+        max_ref_length=config.max_ref_len,
+        sound_norm_refs=config.sound_norm_refs,
+    )
+    clips = []
+    for text in texts:
+        wav = xtts.inference(
+            text, TTS_LANGUAGE, gpt_cond_latent, speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p,
+            enable_text_splitting=True, # 中文单次约 82 字上限，长描述按句切分后拼接
+        )["wav"]
+        if hasattr(wav, "cpu"):
+            wav = wav.cpu().numpy()
+        clips.append(np.asarray(wav, dtype=np.float32).reshape(-1))
+    return model.synthesizer.output_sample_rate, clips
+
+
+# CPU 工作进程中的模型，由进程池的 initializer 加载一次
+process_tts = None
+def init_process_worker():
+    global process_tts
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // TTS_WORKERS))
+    process_tts = load_tts("cpu")
+
+def process_synthesize(style_wav, texts):
+    return synthesize_group(process_tts, style_wav, texts)
+
+
+class SynthesisScheduler:
+    """
+    常驻的 XTTS 合成工作池。台词按情感参考音频分组，各组分块后交给工作者并行合成，
+    结果以内存中的 float32 波形按输入顺序返回，不写临时文件。
+    工作池和其中的模型在第一次合成时创建，之后在多部影片之间复用。
+    """
+
+    def __init__(self, workers=TTS_WORKERS, device=None):
+        self.workers = max(1, workers)
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.executor = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                print(f"Initializing {self.workers} XTTS worker(s) on {self.device}...")
+                if self.device.startswith("cuda"):
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="xtts")
+                else:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_process_worker)
+        return self.executor
+
+    def thread_synthesize(self, style_wav, texts):
+        """GPU 工作线程：每个线程一份模型，在自己的 CUDA stream 上推理。"""
+        if getattr(self.local, "model", None) is None:
+            self.local.model = load_tts(self.device)
+            self.local.stream = torch.cuda.Stream()
+        with torch.cuda.stream(self.local.stream):
+            result = synthesize_group(self.local.model, style_wav, texts)
+        self.local.stream.synchronize()
+        return result
+
+    def synthesize(self, jobs):
+        """
+        Args:
+            jobs (list): [(文本, 参考音频路径), ...]
+
+        Returns:
+            tuple: (采样率, 与 jobs 顺序一致的 float32 波形列表)。没有台词时采样率为 None。
+        """
+        if not jobs:
+            return None, []
+        groups = {}
+        for index, (text, style_wav) in enumerate(jobs):
+            groups.setdefault(style_wav, []).append(index)
+        tasks = []
+        for style_wav, indices in groups.items():
+            for begin in range(0, len(indices), TTS_GROUP_SIZE):
+                tasks.append((style_wav, indices[begin:begin + TTS_GROUP_SIZE]))
+        print(f"XTTS: {len(jobs)} 行台词，{len(groups)} 个参考音频，{len(tasks)} 个任务")
+
+        executor = self.get_executor()
+        worker = self.thread_synthesize if self.device.startswith("cuda") else process_synthesize
+        futures = {
+            executor.submit(worker, style_wav, [jobs[index][0] for index in indices]): indices
+            for style_wav, indices in tasks
+        }
+        sample_rate = None
+        clips = [None] * len(jobs)
+        for future in as_completed(futures):
+            sample_rate, group_clips = future.result()
+            for index, clip in zip(futures[future], group_clips):
+                clips[index] = clip
+        return sample_rate, clips
+
+
+synthesis_scheduler = None
+def get_global_scheduler():
+    global synthesis_scheduler
+    if synthesis_scheduler is None:
+        synthesis_scheduler = SynthesisScheduler()
+    return synthesis_scheduler
+
+
+def fit_duration(clip, sample_rate, max_duration=None):
+    """音频时长超过 max_duration（毫秒）时加速到该时长以内。"""
+    ad_duration = len(clip) * 1000 / sample_rate
+    if max_duration is None or max_duration <= 0 or ad_duration <= max_duration:
+        return clip
+    speed_factor = ad_duration / max_duration
+    ad_audio = AudioSegment((np.clip(clip, -1, 1) * 32767).astype(np.int16).tobytes(), frame_rate=sample_rate, sample_width=2, channels=1)
+    ad_audio = ad_audio.speedup(playback_speed=speed_factor)
+    print(f"调整速度后的音频时长：{len(ad_audio)}ms")
+    return np.frombuffer(ad_audio.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+
+def write_wav(path, samples, sample_rate):
+    """把 float32 单声道波形写成 16 位 PCM WAV。"""
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
 
 def text_to_speech(text, output_path, max_duration=None, style_wav=None):
     """将文本转换为语音，并确保音频时长不超过max_duration"""
-    tts.tts_to_file(
-        text=text,
-        speaker_wav=style_wav,
-        language="zh",
-        file_path=output_path
-    )
-
-    # 获取生成音频的时长
-    ad_audio = AudioSegment.from_wav(output_path)
-    ad_duration = len(ad_audio)
-
-    # 如果音频时长超过max_duration，调整速度
-    if max_duration is not None and ad_duration > max_duration:
-        speed_factor = ad_duration / max_duration
-        ad_audio = ad_audio.speedup(playback_speed=speed_factor)
-        ad_audio.export(output_path, format="wav")
-        print(f"调整速度后的音频时长：{len(ad_audio)}ms")
-
-
-def generate_background_audio(duration_seconds, output_path):
-    """精确生成背景音频"""
-    # 计算精确采样数（44.1kHz标准）
-    samples = int(duration_seconds * 44100)
-    # 生成静音波形数组
-    silent_array = np.zeros((samples, 2), dtype=np.int16)
-    # 创建音频段
-    background = AudioSegment(
-        silent_array.tobytes(),
-        frame_rate=44100,
-        sample_width=2,
-        channels=2
-    )
-    # 精确导出
-    background.export(output_path, format="wav")  # WAV格式更精确
-    print(f"精确生成背景音频：{len(background) / 1000:.3f}秒")
+    sample_rate, clips = get_global_scheduler().synthesize([(text, style_wav or emotion_reference("NEUTRAL"))])
+    write_wav(output_path, fit_duration(clips[0], sample_rate, max_duration), sample_rate)
 
 
 def get_exact_duration(audio_path):
     """获取精确音频时长"""
-    info = mediainfo(audio_path)
-    return float(info['duration'])
+    return media_probe.get_duration(audio_path)
 
 
-def insert_ads_to_audio(background_path, ads, output_path, movie_duration_seconds):
+def insert_ads_to_audio(ads, output_path, movie_duration_seconds):
     """精准插入音频描述"""
     # 按时间排序音频描述
     ads = sorted(ads, key=lambda x: x[0])
-
-    # 加载高精度背景音频
-    background = AudioSegment.from_wav(background_path)
     movie_duration_ms = movie_duration_seconds * 1000
 
-    # 音频描述时间轴校准
-    timeline = []
+    # 选择参考音频，超出影片的描述不合成
+    lines = []
     for start_time, duration, ad_text, emotion in ads:  # 增加emotion参数
-        start_time = float(start_time)
-        duration = float(duration)
-        insert_pos = int(start_time * 1000)
-        max_ad_duration = int(duration * 1000)
-
+        insert_pos = int(float(start_time) * 1000)
+        max_ad_duration = int(float(duration) * 1000)
         if insert_pos >= movie_duration_ms:
             continue
-        
-        
-        emotion_wav_path = os.path.dirname(os.path.abspath(__file__))
-        # 选择风格向量和参考音频文件
-        # emotion_wav_path = "emotion_wav"  # 指定存放情感音频的文件夹路径
-
-        if emotion == "HAPPY":
-            style_wav = os.path.join(emotion_wav_path, "emotion_wav\\happy_6.wav")  # 指定开心风格的参考音频
-        elif emotion == "SAD":
-            style_wav = os.path.join(emotion_wav_path, "emotion_wav\\sad_6.wav")    # 指定悲伤风格的参考音频
-        elif emotion == "NEUTRAL":
-            style_wav = os.path.join(emotion_wav_path, "emotion_wav\\neutral_6.wav") 
-        elif emotion == "ANGRY":
-            style_wav = os.path.join(emotion_wav_path, "emotion_wav\\angry_6.wav")  # 指定愤怒风格的参考音频
-        elif emotion == "SURPRISED":
-            style_wav = os.path.join(emotion_wav_path, "emotion_wav\\surprised_6.wav")  # 指定惊讶风格的参考音频
-        else:
-            style_wav = os.path.join(emotion_wav_path, "emotion_wav\\neutral_6.wav")  # 未知情感默认使用中性风格且无参考音频
-
-        #test
-        # style_vector = angry_vector
-        # style_wav = None  # 测试时强制使用愤怒风格
-
-        # 生成音频描述音频
-        ad_path = f"temp_ad_{insert_pos}.wav"
-        text_to_speech(ad_text, ad_path, max_ad_duration, style_wav=style_wav)  # 传递风格向量和参考音频
+        lines.append((insert_pos, max_ad_duration, ad_text, emotion_reference(emotion)))
 
-        # 获取精确时长
-        ad_audio = AudioSegment.from_wav(ad_path)
-        ad_duration = len(ad_audio)
+    # 所有音频描述并行合成（按参考音频分组）
+    sample_rate, clips = get_global_scheduler().synthesize([(ad_text, style_wav) for _, _, ad_text, style_wav in lines])
 
-        # 动态调整插入策略
-        available_space = movie_duration_ms - insert_pos
-        if ad_duration > available_space:
-            # 裁剪音频描述音频以适应可用空间
-            adjusted_ad = ad_audio[:available_space]
-            adjusted_ad.export(ad_path, format="wav")
-            ad_audio = adjusted_ad
+    # 音频描述时间轴校准
+    timeline = []
+    for (insert_pos, max_ad_duration, _, _), clip in zip(lines, clips):
+        ad_audio = fit_duration(clip, sample_rate, max_ad_duration)
 
-        timeline.append((insert_pos, ad_path))
+        # 动态调整插入策略：裁剪音频描述音频以适应可用空间
+        available_samples = int((movie_duration_ms - insert_pos) * sample_rate / 1000)
+        timeline.append((insert_pos, ad_audio[:available_samples]))
 
     # 时间轴冲突检测
     prev_end = 0
-    for i, (start, path) in enumerate(timeline):
-        ad_audio = AudioSegment.from_wav(path)
-        duration = len(ad_audio)
+    for i, (start, ad_audio) in enumerate(timeline):
+        duration = len(ad_audio) * 1000 / sample_rate
         end = start + duration
 
         if start < prev_end:
             # 解决重叠：顺延插入
-            start = prev_end + 1000  # 留1秒间隔
-            timeline[i] = (start, path)
+            start = int(prev_end) + 1000  # 留1秒间隔
+            timeline[i] = (start, ad_audio)
             end = start + duration
 
         if end > movie_duration_ms:
@@ -144,17 +237,19 @@ def insert_ads_to_audio(background_path, ads, output_path, movie_duration_second
             prev_end = end
 
     # 执行插入
-    background = AudioSegment.silent(duration=movie_duration_ms)
-    for start, path in timeline:
-        if not path:
+    sample_rate = sample_rate or 24000
+    total_samples = int(movie_duration_seconds * sample_rate)
+    background = np.zeros(total_samples, dtype=np.float32)
+    for start, ad_audio in timeline:
+        if ad_audio is None:
             continue
-        ad_audio = AudioSegment.from_wav(path)
-        background = background.overlay(ad_audio, position=start)
+        offset = int(start * sample_rate / 1000)
+        segment = ad_audio[:max(0, total_samples - offset)]
+        background[offset:offset + len(segment)] += segment
 
     # 严格长度控制
-    background = background[:movie_duration_ms]
-    background.export(output_path, format="wav")
-    print(f"最终音频精度：{len(background)}ms")
+    write_wav(output_path, background, sample_rate)
+    print(f"最终音频精度：{total_samples * 1000 / sample_rate:.0f}ms")
 
 
 def get_audio_volume(file_path):
@@ -214,20 +309,6 @@ def cleanup_files(temp_files):
         print(f"清理文件时出错：{e}")
 
 
-def get_video_duration(video_path):
-    """获取视频的时长（秒）"""
-    command = [
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        video_path
-    ]
-    result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8')
-    duration = float(result.stdout.strip())
-    return duration
-
-
 class VolumeAdjustmentGUI:
     # def __init__(self, root, video_path, audio_output_path):
     #     self.root = root
@@ -371,19 +452,18 @@ def T2S(csv_file,final_video_path,video_path):
     # video_path = "test.mp4"  # 视频文件与脚本在同一目录下
 
     # 4. 动态获取视频时长
-    movie_duration_seconds = get_video_duration(video_path)
+    movie_duration_seconds = media_probe.get_duration(video_path)
+    if movie_duration_seconds is None:
+        print(f"错误：无法获取视频 '{video_path}' 的时长，无法生成音频描述音轨。")
+        return
     print(f"视频时长：{movie_duration_seconds:.2f}秒")
 
-    # 5. 生成背景音频
+    # 5. 插入音频描述音频
     current_time = datetime.now().strftime('%Y%m%d_%H%M%S')
-    background_path = f'background_{current_time}.wav'
-    generate_background_audio(movie_duration_seconds, background_path)
-
-    # 6. 插入音频描述音频
     audio_output_path = f'final_audio_{current_time}.wav'
-    insert_ads_to_audio(background_path, ads, audio_output_path, movie_duration_seconds)
+    insert_ads_to_audio(ads, audio_output_path, movie_duration_seconds)
 
-    # 7. 创建GUI
+    # 6. 创建GUI
     # root = tk.Tk()
     # app = VolumeAdjustmentGUI(root, video_path, audio_output_path)
     # root.mainloop()
@@ -393,8 +473,8 @@ def T2S(csv_file,final_video_path,video_path):
     app = VolumeAdjustmentGUI(root, video_path, audio_output_path,start_sec,end_sec,final_video_path)
     root.mainloop()
 
-    # 8. 清理临时文件
-    temp_files = glob.glob("background_*.wav") + glob.glob("final_audio_*.wav") + glob.glob("temp_ad_*.wav") + glob.glob("temp_output_*.mp4")
+    # 7. 清理临时文件
+    temp_files = glob.glob("final_audio_*.wav") + glob.glob("temp_output_*.mp4")
     cleanup_files(temp_files)
 
 